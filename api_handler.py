@@ -3,11 +3,303 @@ import json
 import time
 import base64
 import os
+import threading
 from abc import ABC, abstractmethod
+from requests.adapters import HTTPAdapter
+from resilience import APIError, RetryPolicy, CircuitBreaker
+from request_queue import SingleFlight, payload_key
+from audio_payload import EncodedAudioCache, contains_encoded_audio, iter_json_body
 
 class AIModelAPI(ABC):
     """AI模型API的抽象基类"""
 
+    # 连接池配置，每个子类共享一个HTTP会话（keep-alive复用TCP/TLS连接）
+    pool_connections = 4  # 缓存的主机连接池数量
+    pool_maxsize = 8  # 每个主机保持的最大空闲连接数
+    connect_timeout = 5  # 建立连接超时（秒）
+    read_timeout = 60  # 读取响应超时（秒）
+
+    _session_lock = threading.Lock()
+
+    # 可选的回复缓存（ResponseCache实例），命中时直接返回缓存的回复
+    response_cache = None
+
+    # 合并并发的相同请求，所有子类共享
+    single_flight = SingleFlight()
+
+    # 429/5xx和网络错误的重试策略，以及每个服务商的熔断器参数
+    retry_policy = RetryPolicy()
+    breaker_failure_threshold = 5
+    breaker_recovery_timeout = 30.0
+
+    @classmethod
+    def configure_pool(cls, pool_connections=None, pool_maxsize=None, connect_timeout=None, read_timeout=None):
+        """配置当前子类的连接池参数，已有会话会被关闭并在下次请求时重建"""
+        if pool_connections is not None:
+            cls.pool_connections = pool_connections
+        if pool_maxsize is not None:
+            cls.pool_maxsize = pool_maxsize
+        if connect_timeout is not None:
+            cls.connect_timeout = connect_timeout
+        if read_timeout is not None:
+            cls.read_timeout = read_timeout
+        cls.close_session()
+
+    @classmethod
+    def get_session(cls):
+        """获取当前子类共享的HTTP会话，首次调用时创建"""
+        with cls._session_lock:
+            # 只查找子类自身的属性，保证智谱和Deepseek各自拥有独立的连接池
+            session = cls.__dict__.get("_session")
+            if session is None:
+                session = requests.Session()
+                adapter = HTTPAdapter(
+                    pool_connections=cls.pool_connections,
+                    pool_maxsize=cls.pool_maxsize
+                )
+                session.mount("https://", adapter)
+                session.mount("http://", adapter)
+                cls._session = session
+            return session
+
+    @classmethod
+    def close_session(cls):
+        """关闭当前子类的HTTP会话，释放池中的连接"""
+        with cls._session_lock:
+            session = cls.__dict__.get("_session")
+            if session is not None:
+                session.close()
+                cls._session = None
+
+    @classmethod
+    def get_circuit_breaker(cls):
+        """获取当前子类（服务商）共享的熔断器"""
+        with cls._session_lock:
+            breaker = cls.__dict__.get("_circuit_breaker")
+            if breaker is None:
+                breaker = CircuitBreaker(cls.breaker_failure_threshold, cls.breaker_recovery_timeout)
+                cls._circuit_breaker = breaker
+            return breaker
+
+    @classmethod
+    def pool_stats(cls):
+        """返回连接池统计：hits为复用已有连接的请求数，misses为新建连接数"""
+        stats = {"requests": 0, "hits": 0, "misses": 0}
+        session = cls.__dict__.get("_session")
+        if session is None:
+            return stats
+
+        adapters = {id(adapter): adapter for adapter in session.adapters.values()}
+        for adapter in adapters.values():
+            pools = adapter.poolmanager.pools
+            for key in pools.keys():
+                pool = pools[key]
+                stats["requests"] += pool.num_requests
+                stats["misses"] += pool.num_connections
+        stats["hits"] = max(stats["requests"] - stats["misses"], 0)
+        return stats
+
+    def _post(self, headers, data, stream=False):
+        """通过共享连接池发送POST请求"""
+        if contains_encoded_audio(data):
+            # 含语音数据的请求体分块序列化发送，避免在内存中拼出完整的JSON
+            body = {"data": iter_json_body(data)}
+        else:
+            body = {"json": data}
+        return self.get_session().post(
+            self.api_base_url,
+            headers=headers,
+            timeout=(self.connect_timeout, self.read_timeout),
+            stream=stream,
+            **body
+        )
+
+    def _send(self, headers, data, stream=False):
+        """发送请求，429/5xx和网络错误按退避策略重试，返回成功的响应或APIError
+
+        流式请求成功时不在这里记录熔断器结果，由调用方读完数据流后记录。
+        """
+        breaker = self.get_circuit_breaker()
+        if not breaker.allow_request():
+            return APIError(self.provider_name, "circuit_open", f"{self.provider_name}服务暂时不可用，请稍后重试", retryable=True)
+        
+        policy = self.retry_policy
+        attempt = 0
+        try:
+            while True:
+                retry_after = None
+                try:
+                    response = self._post(headers, data, stream=stream)
+                except requests.RequestException as e:
+                    error = APIError(self.provider_name, "network", str(e), retryable=True)
+                except Exception as e:
+                    # 其他异常不重试，同样计为失败，避免半开状态的探测一直处于进行中
+                    breaker.record_failure()
+                    return APIError(self.provider_name, "unknown", str(e))
+                else:
+                    if response.status_code == 200:
+                        if not stream:
+                            breaker.record_success()
+                        return response
+                    error = self._error_from_response(response)
+                    retry_after = response.headers.get("Retry-After")
+                    response.close()
+                
+                if not error.retryable:
+                    # 服务端能正常返回4xx，说明服务商本身可用
+                    breaker.record_success()
+                    return error
+                if attempt >= policy.max_retries:
+                    breaker.record_failure()
+                    return error
+                
+                delay = policy.compute_delay(attempt, retry_after)
+                print(f"{self.provider_name}请求失败（{error.detail}），{delay:.1f}秒后第{attempt + 1}次重试")
+                time.sleep(delay)
+                attempt += 1
+        except BaseException:
+            # 例如重试等待期间被中断
+            breaker.record_failure()
+            raise
+
+    def _error_from_response(self, response):
+        """把非200响应转换为APIError"""
+        try:
+            error_message = response.json().get("error", {}).get("message", "未知错误")
+        except ValueError:
+            error_message = f"HTTP {response.status_code}"
+        return APIError(
+            self.provider_name,
+            "http",
+            error_message,
+            status_code=response.status_code,
+            retryable=self.retry_policy.is_retryable_status(response.status_code)
+        )
+
+    def _missing_key_error(self):
+        """未配置API密钥时返回的错误"""
+        return APIError(self.provider_name, "config", f"请先在设置中配置{self.provider_name}的API密钥")
+
+    def _complete(self, headers, data, parse_reply):
+        """发送非流式请求，并发的相同请求只发送一次并共享结果"""
+        key = payload_key(self.api_base_url, data)
+        return self.single_flight.do(key, self._complete_once, headers, data, parse_reply)
+
+    def _complete_once(self, headers, data, parse_reply):
+        """发送非流式请求并用parse_reply解析成功的响应，结果写入回复缓存"""
+        cache = self.response_cache
+        if cache is not None:
+            cached = cache.get(data)
+            if cached is not None:
+                return cached
+        
+        response = self._send(headers, data)
+        if isinstance(response, APIError):
+            return response
+        
+        try:
+            result = parse_reply(response.json())
+        except Exception as e:
+            return APIError(self.provider_name, "invalid_response", f"无法解析响应: {str(e)}")
+        if cache is not None:
+            cache.put(data, result)
+        return result
+
+    @staticmethod
+    def _parse_text_reply(response_json):
+        """从响应中提取回复内容"""
+        return response_json.get("choices", [{}])[0].get("message", {}).get("content", "无回复内容")
+
+    def _build_headers(self):
+        """构造请求头"""
+        return {
+            "Content-Type": "application/json",
+            "Authorization": f"Bearer {self.api_key}"
+        }
+
+    def _format_messages(self, messages):
+        """格式化消息为API所需的格式，只保留角色和内容"""
+        formatted_messages = []
+        for message in messages:
+            formatted_messages.append({
+                "role": message["role"],
+                "content": message["content"]
+            })
+        return formatted_messages
+
+    def supports_streaming(self):
+        """当前模型是否支持流式输出"""
+        return True
+
+    def stream_response(self, messages):
+        """以流式方式（SSE）生成回复，逐段产出文本增量
+
+        出错时最后产出一个APIError对象并结束。
+        """
+        if not self.api_key:
+            yield self._missing_key_error()
+            return
+
+        data = self._build_request_data(messages)
+        cache = self.response_cache
+        if cache is not None:
+            cached = cache.get(data)
+            if cached is not None:
+                yield cached
+                return
+
+        stream_data = dict(data, stream=True)
+        chunks = []
+        response = self._send(self._build_headers(), stream_data, stream=True)
+        if isinstance(response, APIError):
+            yield response
+            return
+
+        # 读取数据流期间的错误同样计入熔断器；调用方提前停止读取时按成功处理
+        breaker = self.get_circuit_breaker()
+        failed = False
+        try:
+            with response:
+                for chunk in self._iter_sse_data(response):
+                    choices = chunk.get("choices") or [{}]
+                    delta = choices[0].get("delta", {}).get("content")
+                    if delta:
+                        chunks.append(delta)
+                        yield delta
+        except Exception as e:
+            # 流式传输中途断开，已产出的内容不完整
+            failed = True
+            breaker.record_failure()
+            yield APIError(self.provider_name, "network", str(e), retryable=True)
+            return
+        finally:
+            if not failed:
+                breaker.record_success()
+
+        if cache is not None and chunks:
+            cache.put(data, "".join(chunks))
+
+    @staticmethod
+    def _iter_sse_data(response):
+        """解析server-sent events响应，逐个产出data字段中的JSON对象"""
+        # text/event-stream 通常不带charset，requests会默认按ISO-8859-1解码，这里强制使用UTF-8
+        response.encoding = "utf-8"
+        for line in response.iter_lines(decode_unicode=True):
+            if not line or not line.startswith("data:"):
+                continue
+            payload = line[len("data:"):].strip()
+            if payload == "[DONE]":
+                break
+            try:
+                yield json.loads(payload)
+            except ValueError:
+                print(f"无法解析的流式数据: {payload[:100]}")
+
+    @abstractmethod
+    def _build_request_data(self, messages):
+        """构造请求体的抽象方法"""
+        pass
+
     @abstractmethod
     def generate_response(self, messages):
         """生成回复的抽象方法"""
@@ -20,6 +312,11 @@ class AIModelAPI(ABC):
 
 class ZhipuAI(AIModelAPI):
     """智谱AI API处理类"""
+
+    provider_name = "智谱AI"
+
+    # 语音输入的base64编码缓存，所有实例共享
+    audio_cache = EncodedAudioCache()
     
     def __init__(self, api_key="", model="glm-4"):
         """初始化智谱AI API"""
@@ -36,47 +333,32 @@ class ZhipuAI(AIModelAPI):
         if model_name != "glm-4-voice":
             self.last_audio_id = None
     
+    def supports_streaming(self):
+        """语音模型返回音频数据，不使用流式输出"""
+        return self.model != "glm-4-voice"
+    
+    def _build_request_data(self, messages):
+        """构造智谱AI文本模型的请求体"""
+        return {
+            "model": self.model,
+            "messages": self._format_messages(messages),
+            "temperature": 0.7,
+            "top_p": 0.8
+        }
+    
     def generate_response(self, messages):
         """调用智谱AI API生成回复"""
         if not self.api_key:
-            return "请先在设置中配置智谱AI的API密钥"
+            return self._missing_key_error()
         
-        headers = {
-            "Content-Type": "application/json",
-            "Authorization": f"Bearer {self.api_key}"
-        }
+        headers = self._build_headers()
         
         # 检查是否是语音模型
         if self.model == "glm-4-voice":
             return self._generate_voice_response(messages, headers)
         
-        # 格式化消息为智谱AI API所需的格式
-        formatted_messages = []
-        for message in messages:
-            formatted_messages.append({
-                "role": message["role"],
-                "content": message["content"]
-            })
-        
-        data = {
-            "model": self.model,
-            "messages": formatted_messages,
-            "temperature": 0.7,
-            "top_p": 0.8
-        }
-        
-        try:
-            response = requests.post(self.api_base_url, headers=headers, json=data)
-            response_json = response.json()
-            
-            if response.status_code == 200:
-                # 从响应中提取回复内容
-                return response_json.get("choices", [{}])[0].get("message", {}).get("content", "无回复内容")
-            else:
-                error_message = response_json.get("error", {}).get("message", "未知错误")
-                return f"API调用错误: {error_message}"
-        except Exception as e:
-            return f"API调用错误: {str(e)}"
+        data = self._build_request_data(messages)
+        return self._complete(headers, data, self._parse_text_reply)
     
     def _generate_voice_response(self, messages, headers):
         """调用智谱AI语音模型API生成语音回复"""
@@ -93,12 +375,11 @@ class ZhipuAI(AIModelAPI):
         for message in messages:
             if message["role"] == "user":
                 # 用户消息可能包含文本或语音
-                if message.get("audio_file"):
-                    # 如果包含语音文件路径，进行语音输入
-                    audio_file = message["audio_file"]
+                if message.get("audio_data") is not None or message.get("audio_file"):
+                    # 语音可以是内存中的WAV数据（bytes、memoryview或BytesIO），也可以是文件路径，
+                    # 编码结果会被缓存，历史中较早轮次的语音不会重复读取和编码
                     try:
-                        with open(audio_file, "rb") as f:
-                            audio_data = base64.b64encode(f.read()).decode("utf-8")
+                        audio_data = self.audio_cache.get(message)
                         
                         # 确保文本内容不为空，如果为空则提供默认值
                         text_content = message["content"]
@@ -119,7 +400,7 @@ class ZhipuAI(AIModelAPI):
                             }
                         ]
                     except Exception as e:
-                        return f"处理语音文件时出错: {str(e)}"
+                        return APIError(self.provider_name, "audio", f"处理语音文件时出错: {str(e)}")
                 else:
                     # 纯文本输入，确保文本不为空
                     text_content = message["content"]
@@ -180,51 +461,47 @@ class ZhipuAI(AIModelAPI):
             "top_p": 0.8
         }
         
-        try:
-            response = requests.post(self.api_base_url, headers=headers, json=data)
-            response_json = response.json()
-            
-            if response.status_code == 200:
-                # 从响应中提取回复内容和语音
-                reply = response_json.get("choices", [{}])[0].get("message", {})
-                text_content = reply.get("content", "无回复内容")
-                
-                # 获取语音数据
-                audio = reply.get("audio", {})
-                audio_data = audio.get("data")
-                audio_id = audio.get("id")
-                
-                # 更新最后一个有效的 audio_id
-                if audio_id:
-                    self.last_audio_id = audio_id
-                
-                # 如果有语音数据，保存到临时文件
-                audio_file = None
-                if audio_data:
-                    try:
-                        temp_dir = os.path.join(os.path.dirname(__file__), "temp")
-                        if not os.path.exists(temp_dir):
-                            os.makedirs(temp_dir)
-                        
-                        audio_file = os.path.join(temp_dir, f"{audio_id}.wav")
-                        with open(audio_file, "wb") as f:
-                            f.write(base64.b64decode(audio_data))
-                    except Exception as e:
-                        print(f"保存语音文件时出错: {str(e)}")
+        result = self._complete(headers, data, self._parse_voice_reply)
+        
+        # 更新最后一个有效的 audio_id（缓存命中时同样需要）
+        if isinstance(result, dict) and result.get("audio_id"):
+            self.last_audio_id = result["audio_id"]
+        return result
+    
+    def _parse_voice_reply(self, response_json):
+        """从语音模型的响应中提取回复内容和语音，语音数据保存到临时文件"""
+        reply = response_json.get("choices", [{}])[0].get("message", {})
+        text_content = reply.get("content", "无回复内容")
+        
+        # 获取语音数据
+        audio = reply.get("audio", {})
+        audio_data = audio.get("data")
+        audio_id = audio.get("id")
+        
+        # 如果有语音数据，保存到临时文件
+        audio_file = None
+        if audio_data:
+            try:
+                temp_dir = os.path.join(os.path.dirname(__file__), "temp")
+                if not os.path.exists(temp_dir):
+                    os.makedirs(temp_dir)
                 
-                return {
-                    "text": text_content,
-                    "audio_file": audio_file,
-                    "audio_id": audio_id
-                }
-            else:
-                error_message = response_json.get("error", {}).get("message", "未知错误")
-                return f"API调用错误: {error_message}"
-        except Exception as e:
-            return f"API调用错误: {str(e)}"
+                audio_file = os.path.join(temp_dir, f"{audio_id}.wav")
+                with open(audio_file, "wb") as f:
+                    f.write(base64.b64decode(audio_data))
+            except Exception as e:
+                print(f"保存语音文件时出错: {str(e)}")
+        
+        return {
+            "text": text_content,
+            "audio_file": audio_file,
+            "audio_id": audio_id
+        }
 
 class DeepseekAI(AIModelAPI):
     """Deepseek AI API处理类"""
+
+    provider_name = "Deepseek"
     
     def __init__(self, api_key="", model="deepseek-chat"):
         """初始化Deepseek AI API"""
@@ -236,43 +513,23 @@ class DeepseekAI(AIModelAPI):
         """设置模型名称"""
         self.model = model_name
     
-    def generate_response(self, messages):
-        """调用Deepseek AI API生成回复"""
-        if not self.api_key:
-            return "请先在设置中配置Deepseek的API密钥"
-        
-        headers = {
-            "Content-Type": "application/json",
-            "Authorization": f"Bearer {self.api_key}"
-        }
-        
-        # 格式化消息为Deepseek API所需的格式
-        formatted_messages = []
-        for message in messages:
-            formatted_messages.append({
-                "role": message["role"],
-                "content": message["content"]
-            })
-        
-        data = {
+    def _build_request_data(self, messages):
+        """构造Deepseek的请求体"""
+        return {
             "model": self.model,
-            "messages": formatted_messages,
+            "messages": self._format_messages(messages),
             "temperature": 0.7,
             "max_tokens": 1000
         }
+    
+    def generate_response(self, messages):
+        """调用Deepseek AI API生成回复"""
+        if not self.api_key:
+            return self._missing_key_error()
         
-        try:
-            response = requests.post(self.api_base_url, headers=headers, json=data)
-            response_json = response.json()
-            
-            if response.status_code == 200:
-                # 从响应中提取回复内容
-                return response_json.get("choices", [{}])[0].get("message", {}).get("content", "无回复内容")
-            else:
-                error_message = response_json.get("error", {}).get("message", "未知错误")
-                return f"API调用错误: {error_message}"
-        except Exception as e:
-            return f"API调用错误: {str(e)}"
+        headers = self._build_headers()
+        data = self._build_request_data(messages)
+        return self._complete(headers, data, self._parse_text_reply)
 
 
 # 如果直接运行此文件，执行简单的API测试
@@ -302,6 +559,7 @@ if __name__ == "__main__":
             {"role": "user", "content": "你好，请做个自我介绍。"}
         ])
         print(f"模型回复: {response}\n")
+        print(f"连接池统计: {ZhipuAI.pool_stats()}")
         
         # 如果想测试语音模型，需要有音频文件
         print("API处理器测试完成。要测试完整功能，请运行app.py。")
\ No newline at end of file
@@ -1,11 +1,25 @@
 import tkinter as tk
 from tkinter import ttk, scrolledtext, filedialog, messagebox
 import threading
+import queue
+import hashlib
+import multiprocessing
 import os
 import json
-import time
-from api_handler import ZhipuAI, DeepseekAI
+import uuid
+from api_handler import AIModelAPI, ZhipuAI, DeepseekAI
+from artifact_store import ArtifactStore
+from async_api import EventLoopThread, build_fanout_apis, fan_out
 from audio_handler import AudioHandler
+from context_manager import ContextManager, estimate_tokens
+from doc_index import load_or_build_index
+from doc_qa import DocumentQA, chunk_text
+from response_cache import ResponseCache
+from resilience import APIError
+from request_queue import RequestQueue, payload_key
+from speech_backends import create_backend
+from transcript_view import TranscriptView
+from tts_worker import SentenceSplitter
 
 class AIAssistantApp:
     def __init__(self, root):
@@ -33,22 +47,62 @@ class AIAssistantApp:
         self.style.configure("TLabelframe.Label", background=self.bg_color, foreground=self.accent_color, font=("Microsoft YaHei", 9, "bold"))
         self.style.configure("TCheckbutton", background=self.bg_color)
         
+        # 回复缓存，相同的模型、消息和采样参数直接返回缓存的回复
+        try:
+            AIModelAPI.response_cache = ResponseCache()
+        except Exception as e:
+            print(f"初始化回复缓存时出错: {str(e)}")
+        
         # 设置API实例
         self.zhipu_ai = ZhipuAI()
         self.deepseek_ai = DeepseekAI()
         self.current_api = self.zhipu_ai  # 默认使用智谱AI
         
+        # 智谱AI降级（熔断或重试后仍失败）时是否自动切换到Deepseek
+        self.enable_failover = True
+        
+        # 对话请求队列：按顺序串行处理每轮对话，忽略重复提交
+        self.request_queue = RequestQueue()
+        
+        # 多模型并发模式：None表示单模型，"first"取最快回复，"all"并排对比
+        self.fanout_mode = None
+        self.event_loop = EventLoopThread()
+        
         # 音频处理
         self.audio_handler = AudioHandler()
+        self.audio_handler.partial_callback = self.show_partial_transcript
+        
+        # 配置文件内容
+        self.config = {}
         
         # 对话历史记录
         self.conversation_history = []
         
+        # 按模型token预算裁剪每轮发送的历史，较早的对话折叠为摘要
+        self.context_manager = ContextManager()
+        
         # 最后一次语音回复的音频ID，用于多轮对话
         self.last_audio_id = None
         
+        # 文档模式：较大的文档切分为分块，提问时分段并发分析后合并回答
+        self.active_document = None
+        self.document_inline_tokens = 3000  # 不超过该大小的文档直接放入输入框
+        self.document_chunk_tokens = 1500
+        self.document_workers = 3
+        self.document_top_k = 4  # 每个问题附带的最相关分块数
+        self.document_min_score = 1.0  # 低于该BM25得分的分块不算命中，只匹配到常见词的问题改为逐段分析
+        
+        # temp目录中的语音文件按对话登记，清空对话或超出配额时由后台线程回收
+        self.artifact_store = ArtifactStore()
+        self.conversation_id = uuid.uuid4().hex
+        
+        # 界面更新队列：后台线程只向队列提交更新，由主线程定时取出并合并后一次性刷新
+        self.ui_queue = queue.Queue()
+        self.ui_pump_interval = 50  # 毫秒
+        
         # 创建UI
         self.create_widgets()
+        self.root.after(self.ui_pump_interval, self._drain_ui_queue)
         
         # 加载配置
         self.load_config()
@@ -76,7 +130,9 @@ class AIAssistantApp:
             "智谱AI-GLM-3-Turbo",
             "智谱AI-GLM-4-Voice",
             "Deepseek-Coder", 
-            "Deepseek-Chat"
+            "Deepseek-Chat",
+            "多模型-最快回复",
+            "多模型-并排对比"
         ]
         model_menu = ttk.OptionMenu(model_frame, self.model_var, model_options[0], *model_options, command=self.change_model)
         model_menu.pack(padx=8, pady=8)  # 增加内边距
@@ -119,7 +175,11 @@ class AIAssistantApp:
             relief=tk.FLAT
         )
         self.conversation_text.pack(fill=tk.BOTH, expand=True, padx=5, pady=5)
+        self.conversation_text.tag_config("sender", foreground=self.accent_color, font=("Microsoft YaHei", 10, "bold"))
+        self.conversation_text.tag_config("message", foreground=self.text_color, font=("Microsoft YaHei", 10))
         self.conversation_text.config(state=tk.DISABLED)
+        # 对话框只渲染最近的消息，滚动到顶部时载入更早的消息
+        self.transcript = TranscriptView(self.conversation_text)
         
         # 底部输入区域
         input_frame = ttk.Frame(main_frame)
@@ -184,7 +244,10 @@ class AIAssistantApp:
     
     def change_model(self, selection):
         """更改当前使用的AI模型"""
-        if "智谱AI" in selection:
+        self.fanout_mode = None
+        if "多模型" in selection:
+            self.fanout_mode = "first" if "最快" in selection else "all"
+        elif "智谱AI" in selection:
             self.current_api = self.zhipu_ai
             if "GLM-4-Voice" in selection:
                 self.zhipu_ai.set_model("glm-4-voice")
@@ -202,7 +265,7 @@ class AIAssistantApp:
             else:
                 self.deepseek_ai.set_model("deepseek-chat")
         
-        self.status_var.set(f"已切换到 {selection}")
+        self.set_status(f"已切换到 {selection}")
     
     def send_message(self):
         """发送消息到AI模型并获取回复"""
@@ -210,54 +273,110 @@ class AIAssistantApp:
         if not user_input and not self.voice_input_var.get():
             return
         
+        # 语音模型在提交时取出录音，排队期间的新录音不会替换本轮的音频
+        audio_data = None
+        if self.voice_input_var.get() and self.current_api == self.zhipu_ai and self.current_api.model == "glm-4-voice":
+            audio_stream = self.audio_handler.get_audio_bytes()
+            if audio_stream is not None:
+                audio_data = audio_stream.getvalue()
+        
+        # 双击发送或重复按Ctrl+Enter时，相同的请求只处理一次；录音内容不同的语音请求视为不同的请求
+        audio_digest = hashlib.sha256(audio_data).hexdigest() if audio_data else None
+        request_key = payload_key(self.model_var.get(), user_input, audio_digest)
+        if self.request_queue.is_pending(request_key):
+            self.set_status("相同的请求正在处理中...")
+            return
+        # 队列已满时保留输入框内容，不显示也不发送本轮消息
+        if self.request_queue.is_full():
+            self.set_status("请求过多，请等待当前回复完成")
+            return
+        
+        # 在主线程中读取界面选项，后台线程不访问Tk变量
+        options = {
+            "voice_input": self.voice_input_var.get(),
+            "voice_output": self.voice_output_var.get(),
+            "audio_data": audio_data
+        }
+        
         # 清空输入框
         self.input_text.delete("1.0", tk.END)
         
-        # 在对话框中添加用户消息
+        # 在对话框中添加用户消息（先于提交进入界面队列，保证显示在回复之前）
         self.add_message("用户", user_input)
         
         # 更新状态
-        self.status_var.set("正在生成回复...")
+        self.set_status("正在生成回复...")
         
-        threading.Thread(target=self.process_request, args=(user_input,), daemon=True).start()
+        # 只有主线程提交请求，上面已检查过容量，这里通常不会被拒绝；被拒绝时恢复输入框内容
+        if not self.request_queue.submit(request_key, self.process_request, user_input, options):
+            self.set_input_text(user_input)
+            self.add_message("系统", "上一条消息未能发送，请稍后重试")
+            self.set_status("请求过多，请等待当前回复完成")
     
-    def process_request(self, user_input):
-        """处理AI请求的线程"""
+    def process_request(self, user_input, options):
+        """处理AI请求的线程，options为提交时的语音输入/输出选项和录音数据"""
+        if self.fanout_mode:
+            self.process_fanout_request(user_input)
+            return
+        
+        # 处理期间对话被清空时丢弃本轮结果，不写入新的对话
+        conversation_id = self.conversation_id
         try:
+            document_context = None
+            if self.active_document is not None and not (self.current_api == self.zhipu_ai and self.current_api.model == "glm-4-voice"):
+                # 只附带检索到的相关分块；没有匹配的分块时（例如要求总结全文）逐段分析
+                document_context = self._document_context(user_input)
+                if document_context is None:
+                    self.process_document_request(user_input, options)
+                    return
+            
             # 检查是否启用了语音模型和语音输入
             is_voice_model = self.current_api == self.zhipu_ai and self.current_api.model == "glm-4-voice"
             
             # 创建消息对象
             user_message = {"role": "user", "content": user_input}
             
-            # 如果使用语音模型且启用了语音输入，获取最后录制的音频文件路径
-            if is_voice_model and self.voice_input_var.get():
-                audio_file_path = self.audio_handler.get_audio_file_path()
-                if audio_file_path:
-                    user_message["audio_file"] = audio_file_path
+            # 如果使用语音模型且启用了语音输入，直接附带提交时取出的录音数据
+            if is_voice_model and options["audio_data"] is not None:
+                user_message["audio_data"] = options["audio_data"]
             
             # 将消息添加到历史记录
             self.conversation_history.append(user_message)
             
             # 如果上一次有语音回复，添加语音ID到对话中以维持多轮对话
-            if is_voice_model and self.last_audio_id:
-                for i, msg in enumerate(self.conversation_history):
-                    # 找到最后一个助手回复，添加audio_id
-                    if msg["role"] == "assistant" and i > 0 and i == len(self.conversation_history) - 2:
-                        msg["audio_id"] = self.last_audio_id
-                        break
+            if is_voice_model and self.last_audio_id and len(self.conversation_history) >= 3:
+                # 最后一个助手回复位于当前用户消息之前，添加audio_id
+                last_reply = self.conversation_history[-2]
+                if last_reply["role"] == "assistant":
+                    last_reply["audio_id"] = self.last_audio_id
             
-            # 发送请求给AI
-            response = self.current_api.generate_response(self.conversation_history)
+            # 只发送预算内的最近对话，更早的内容以摘要形式附带
+            messages = self.context_manager.build_messages(self.conversation_history, self.current_api.model)
+            if document_context is not None:
+                messages.insert(0, document_context)
+            
+            # 发送请求给AI，支持流式输出的模型边生成边显示
+            streamed = not is_voice_model and self.current_api.supports_streaming()
+            response = self._request_reply(messages, streamed, options["voice_output"], conversation_id)
+            if conversation_id != self.conversation_id:
+                print("对话已清空，丢弃过期的回复")
+                return
             
             # 处理响应
-            if is_voice_model and isinstance(response, dict):
+            if isinstance(response, APIError):
+                # 错误不写入对话历史，同时撤回本轮的用户消息，避免历史中出现连续的用户消息
+                self.conversation_history.pop()
+                self.add_message("AI 助手", f"错误：{response}")
+                self.set_status("错误")
+                return
+            elif is_voice_model and isinstance(response, dict):
                 # 如果是语音模型返回的字典响应
                 text_response = response.get("text", "")
                 audio_file = response.get("audio_file")
                 audio_id = response.get("audio_id")
                 
                 print(f"收到语音模型响应: text={text_response[:30]}..., audio_file={audio_file}, audio_id={audio_id}")
+                self.artifact_store.register(audio_file, self.conversation_id)
                 
                 # 保存语音ID用于多轮对话
                 self.last_audio_id = audio_id
@@ -269,17 +388,18 @@ class AIAssistantApp:
                 self.add_message("AI 助手", text_response)
                 
                 # 如果启用了语音输出并有音频文件，播放语音回复
-                if self.voice_output_var.get() and audio_file and os.path.exists(audio_file):
+                if options["voice_output"] and audio_file and os.path.exists(audio_file):
                     print(f"准备播放智谱语音文件: {audio_file}")
                     # 确保音频文件可以访问且不为空
                     if os.path.getsize(audio_file) > 0:
-                        threading.Thread(target=self.audio_handler.play_audio_file, args=(audio_file,), daemon=True).start()
+                        self.artifact_store.touch(audio_file)
+                        self.audio_handler.playback.play(audio_file, preempt=True)
                     else:
                         print(f"警告：智谱返回的音频文件为空: {audio_file}")
                         # 尝试使用本地TTS作为备用
-                        threading.Thread(target=self.audio_handler.text_to_speech, args=(text_response,), daemon=True).start()
+                        self.audio_handler.text_to_speech(text_response)
                 else:
-                    if not self.voice_output_var.get():
+                    if not options["voice_output"]:
                         print("语音输出未启用")
                     elif not audio_file:
                         print("未收到音频文件")
@@ -291,91 +411,390 @@ class AIAssistantApp:
                     # 将AI的回复添加到历史记录
                     self.conversation_history.append({"role": "assistant", "content": response})
                     
-                    # 在UI上显示回复
-                    self.add_message("AI 助手", response)
+                    # 在UI上显示回复（流式回复已增量显示）
+                    if not streamed:
+                        self.add_message("AI 助手", response)
                     
-                    # 如果启用了语音输出，使用本地TTS引擎播放
-                    if self.voice_output_var.get():
+                    # 如果启用了语音输出，使用本地TTS引擎播放（流式回复已边接收边朗读）
+                    if options["voice_output"] and not streamed:
                         print(f"使用本地TTS朗读文本: {response[:30]}...")
-                        threading.Thread(target=self.audio_handler.text_to_speech, args=(response,), daemon=True).start()
+                        self.audio_handler.text_to_speech(response)
                 else:
-                    error_msg = "未知响应格式"
-                    if response:
-                        error_msg = str(response)
-                    self.add_message("AI 助手", f"错误：{error_msg}")
+                    self.conversation_history.pop()
+                    self.add_message("AI 助手", f"错误：未知响应格式 {response!r}")
             
             # 更新状态
-            self.status_var.set("回复完成")
+            self.set_status("回复完成")
         except Exception as e:
             error_message = f"生成回复时出错: {str(e)}"
             print(error_message)
             import traceback
             traceback.print_exc()
-            messagebox.showerror("错误", error_message)
-            self.status_var.set("错误")
+            self.show_error("错误", error_message)
+            self.set_status("错误")
     
-    def add_message(self, sender, message):
-        """将消息添加到对话框"""
-        self.conversation_text.config(state=tk.NORMAL)
+    def process_fanout_request(self, user_input):
+        """把同一问题并发发送给多个模型，显示最快的回复或全部回复"""
+        conversation_id = self.conversation_id
+        try:
+            self.conversation_history.append({"role": "user", "content": user_input})
+            apis = build_fanout_apis(self.zhipu_ai.api_key, self.deepseek_ai.api_key)
+            budget = min(self.context_manager.get_budget(api.api.model) for api in apis)
+            messages = self.context_manager.build_messages(self.conversation_history, budget=budget)
+            results = self.event_loop.run(fan_out(apis, messages, mode=self.fanout_mode))
+            if conversation_id != self.conversation_id:
+                print("对话已清空，丢弃过期的回复")
+                return
+            
+            for result in results:
+                self.add_message(f"{result['name']} ({result['latency']:.2f}秒)", str(result["response"]))
+            
+            # 以最先成功的回复作为对话历史，保持后续多轮对话的上下文
+            answered = [result for result in results if result["ok"]]
+            if answered:
+                self.conversation_history.append({"role": "assistant", "content": answered[0]["response"]})
+            else:
+                self.conversation_history.pop()
+            
+            latency_summary = "，".join(f"{result['name']} {result['latency']:.2f}秒" for result in results)
+            self.set_status(f"回复完成：{latency_summary}")
+        except Exception as e:
+            error_message = f"生成回复时出错: {str(e)}"
+            print(error_message)
+            self.show_error("错误", error_message)
+            self.set_status("错误")
+    
+    def _document_context(self, question):
+        """检索与问题最相关的文档分块，返回附带这些分块的系统消息，没有匹配时返回None"""
+        document = self.active_document
+        if document["index"] is None:
+            # 索引保存在提取结果旁，首次提问时加载或建立
+            self.set_status(f"正在建立文档《{document['name']}》的检索索引...")
+            document["index"] = load_or_build_index(
+                self.audio_handler.extraction_cache,
+                document["cache_key"],
+                document["chunks"],
+                document["chunk_tokens"]
+            )
         
-        # 添加发送者信息
-        self.conversation_text.insert(tk.END, f"\n{sender}: ", "sender")
+        results = document["index"].search(question, self.document_top_k, self.document_min_score)
+        if not results:
+            return None
+        
+        # 附带的分块总量不超过当前模型预算的一半，保证每轮请求大小恒定；按得分从高到低取，再按文档顺序排列
+        budget = self.context_manager.get_budget(self.current_api.model) // 2
+        used = 0
+        kept = []
+        for _, doc_id, chunk in results:
+            if kept and used + chunk["tokens"] > budget:
+                continue
+            used += chunk["tokens"]
+            kept.append((doc_id, chunk))
+        sections = [
+            f"【片段{doc_id + 1}，第{chunk['page']}页起】\n{chunk['text']}"
+            for doc_id, chunk in sorted(kept, key=lambda item: item[0])
+        ]
+        self.set_status(f"已检索到{len(sections)}个相关片段，正在生成回复...")
+        return {
+            "role": "system",
+            "content": f"以下是文档《{document['name']}》中与用户问题相关的片段，请根据这些内容回答，并注明页码：\n\n"
+                       + "\n\n".join(sections)
+        }
+    
+    def process_document_request(self, user_input, options):
+        """文档模式：把问题和文档各分块并发发送给模型，合并局部回答"""
+        document = self.active_document
+        conversation_id = self.conversation_id
+        try:
+            # 文档内容不写入对话历史，后续轮次只发送问题和回答
+            recent = [
+                {"role": message["role"], "content": message["content"]}
+                for message in self.conversation_history[-4:]
+            ]
+            self.conversation_history.append({"role": "user", "content": user_input})
+            
+            def progress(stage, done, total):
+                if stage == "map":
+                    self.set_status(f"正在分析文档《{document['name']}》: {done}/{total}段")
+                else:
+                    self.set_status(f"正在汇总{total}组局部回答...")
+            
+            qa = DocumentQA(self.current_api, max_workers=self.document_workers)
+            response = qa.answer(user_input, document["chunks"], history=recent, progress=progress)
+            if conversation_id != self.conversation_id:
+                print("对话已清空，丢弃过期的回复")
+                return
+            
+            if isinstance(response, APIError):
+                self.conversation_history.pop()
+                self.add_message("AI 助手", f"错误：{response}")
+                self.set_status("错误")
+                return
+            
+            self.conversation_history.append({"role": "assistant", "content": response})
+            self.add_message("AI 助手", response)
+            if options["voice_output"]:
+                self.audio_handler.text_to_speech(response)
+            self.set_status("回复完成")
+        except Exception as e:
+            error_message = f"生成回复时出错: {str(e)}"
+            print(error_message)
+            self.show_error("错误", error_message)
+            self.set_status("错误")
+    
+    def _failover_api(self):
+        """返回当前模型的备用服务商，未启用或不可用时返回None"""
+        if not self.enable_failover or self.current_api is not self.zhipu_ai:
+            return None
+        if self.zhipu_ai.model == "glm-4-voice" or not self.deepseek_ai.api_key:
+            return None
+        return self.deepseek_ai
+    
+    def _request_reply(self, messages, streamed, voice_output=False, conversation_id=None):
+        """向当前模型请求回复，服务商降级时切换到备用服务商"""
+        api = self.current_api
+        fallback = self._failover_api()
+        if fallback is not None and api.get_circuit_breaker().is_open():
+            print(f"{api.provider_name}处于熔断状态，直接使用{fallback.provider_name}")
+            api = fallback
+        
+        partial = False
+        if streamed:
+            response, partial = self._stream_reply(messages, api, voice_output, conversation_id)
+        else:
+            response = api.generate_response(messages)
         
-        # 添加消息内容
-        self.conversation_text.insert(tk.END, f"{message}\n", "message")
+        # 已经显示了部分流式回复时不再切换，避免同一轮出现两条回复
+        if isinstance(response, APIError) and response.retryable and not partial and fallback is not None and api is not fallback:
+            self.set_status(f"{api.provider_name}暂时不可用，已切换到{fallback.provider_name}...")
+            if streamed:
+                response, _ = self._stream_reply(messages, fallback, voice_output, conversation_id)
+            else:
+                response = fallback.generate_response(messages)
+        return response
+    
+    def _stream_reply(self, messages, api, voice_output=False, conversation_id=None):
+        """流式获取回复并把增量放入队列，返回(完整的回复文本或APIError, 是否已显示部分内容)
+        
+        启用语音输出时，每收到一个完整的句子就交给TTS朗读，不等待整段回复。
+        conversation_id对应的对话被清空后停止接收，不再显示后续增量。
+        中途出错时在已显示的部分回复末尾注明回复中断。
+        """
+        if conversation_id is not None and conversation_id != self.conversation_id:
+            return "", False
+        splitter = SentenceSplitter() if voice_output else None
+        chunks = []
+        stream = api.stream_response(messages)
+        try:
+            for delta in stream:
+                if conversation_id is not None and conversation_id != self.conversation_id:
+                    break
+                if isinstance(delta, APIError):
+                    if splitter is not None:
+                        self.audio_handler.stop_speaking()
+                    if chunks:
+                        self.ui_queue.put(("delta", "\n（回复中断，以上内容不完整）"))
+                    return delta, bool(chunks)
+                if not chunks:
+                    # 收到第一段内容时才显示回复，出错后切换服务商时不会留下空的回复
+                    self.ui_queue.put(("start", "AI 助手"))
+                chunks.append(delta)
+                self.ui_queue.put(("delta", delta))
+                if splitter is not None:
+                    for sentence in splitter.feed(delta):
+                        self.audio_handler.speak_sentence(sentence)
+            if splitter is not None:
+                for sentence in splitter.flush():
+                    self.audio_handler.speak_sentence(sentence)
+        finally:
+            stream.close()
+            if chunks:
+                self.ui_queue.put(("end", None))
+        return "".join(chunks), bool(chunks)
+    
+    def set_status(self, text):
+        """更新状态栏（任意线程可调用）"""
+        self.ui_queue.put(("status", text))
+    
+    def add_message(self, sender, message):
+        """将消息添加到对话框（任意线程可调用）"""
+        self.ui_queue.put(("message", (sender, message)))
+    
+    def set_input_text(self, text):
+        """替换输入框的内容（任意线程可调用）"""
+        self.ui_queue.put(("input", text))
+    
+    def show_error(self, title, message):
+        """弹出错误对话框（任意线程可调用）"""
+        self.ui_queue.put(("error", (title, message)))
+    
+    def run_on_ui(self, func, *args):
+        """在主线程中执行func（任意线程可调用）"""
+        self.ui_queue.put(("call", (func, args)))
+    
+    def _drain_ui_queue(self):
+        """在主线程中取出所有待处理的界面更新，合并后一次性刷新
         
-        # 应用标签样式
-        self.conversation_text.tag_config("sender", foreground=self.accent_color, font=("Microsoft YaHei", 10, "bold"))
-        self.conversation_text.tag_config("message", foreground=self.text_color, font=("Microsoft YaHei", 10))
+        连续的流式增量合并为一次插入，状态栏、语音按钮和输入框只应用最后的值，
+        对话框在一轮处理中只切换一次可编辑状态并滚动一次。
+        单个更新出错时只记录错误，不影响其余更新和之后的刷新。
+        """
+        try:
+            self._apply_ui_updates()
+        except Exception as e:
+            print(f"界面更新出错: {str(e)}")
+        finally:
+            self.root.after(self.ui_pump_interval, self._drain_ui_queue)
+    
+    def _apply_ui_updates(self):
+        """取出并应用队列中的全部界面更新"""
+        pending = []
+        try:
+            while True:
+                pending.append(self.ui_queue.get_nowait())
+        except queue.Empty:
+            pass
+        if not pending:
+            return
         
-        # 滚动到底部
-        self.conversation_text.see(tk.END)
-        self.conversation_text.config(state=tk.DISABLED)
+        status = None
+        voice_button = None
+        text_ops = []  # [(类型, 值)]，对话框的待处理更新
+        input_value = None  # 输入框的最新内容，None表示没有更新
+        
+        def flush_text():
+            if not text_ops:
+                return
+            with self.transcript.batch():
+                for kind, value in text_ops:
+                    try:
+                        if kind == "delta":
+                            self.transcript.append_stream(value)
+                        elif kind == "start":
+                            self.transcript.start_stream(value)
+                        elif kind == "end":
+                            self.transcript.end_stream()
+                        else:
+                            self.transcript.append(*value)
+                    except Exception as e:
+                        print(f"更新对话框时出错: {str(e)}")
+            text_ops.clear()
+        
+        def flush_input():
+            nonlocal input_value
+            if input_value is None:
+                return
+            try:
+                self.input_text.delete("1.0", tk.END)
+                self.input_text.insert("1.0", input_value)
+            except Exception as e:
+                print(f"更新输入框时出错: {str(e)}")
+            input_value = None
+        
+        for kind, value in pending:
+            if kind == "status":
+                status = value
+            elif kind == "voice_button":
+                voice_button = value
+            elif kind == "delta":
+                # 连续的流式增量合并为一次插入
+                if text_ops and text_ops[-1][0] == "delta":
+                    text_ops[-1] = ("delta", text_ops[-1][1] + value)
+                else:
+                    text_ops.append((kind, value))
+            elif kind in ("start", "end", "message"):
+                text_ops.append((kind, value))
+            elif kind == "clear":
+                text_ops.clear()
+                try:
+                    self.transcript.clear()
+                except Exception as e:
+                    print(f"清空对话框时出错: {str(e)}")
+            elif kind == "input":
+                # 输入框更新（例如与状态交替提交的部分识别结果）只应用最后一次
+                input_value = value
+            else:
+                # 回调和对话框可能依赖之前的更新，先写入已累积的文本和输入框内容
+                flush_text()
+                flush_input()
+                try:
+                    if kind == "error":
+                        messagebox.showerror(*value)
+                    elif kind == "call":
+                        func, args = value
+                        func(*args)
+                except Exception as e:
+                    print(f"界面更新出错: {str(e)}")
+        flush_text()
+        flush_input()
+        
+        if voice_button is not None:
+            self.voice_button_text.set(voice_button)
+        if status is not None:
+            self.status_var.set(status)
     
     def toggle_voice_input(self):
         """切换语音输入状态"""
         if self.voice_button_text.get() == "开始语音":
             self.voice_button_text.set("停止语音")
-            self.status_var.set("正在录音...")
+            self.set_status("正在录音...")
+            
+            # 开始说话时打断正在进行的朗读
+            self.audio_handler.stop_speaking()
             
             # 在新线程中启动录音
             threading.Thread(target=self.record_audio, daemon=True).start()
         else:
             self.voice_button_text.set("开始语音")
-            self.status_var.set("录音已停止，正在处理...")
+            self.set_status("录音已停止，正在处理...")
             self.audio_handler.stop_recording()
     
     def record_audio(self):
         """录制音频并转换为文本"""
-        # 开始录音
-        self.audio_handler.start_recording()
+        # 检查当前是否使用语音模型，语音模型和本地识别各自使用配置的采样率
+        is_voice_model = self.current_api == self.zhipu_ai and self.current_api.model == "glm-4-voice"
         
-        # 等待录音停止
-        while self.audio_handler.is_recording:
-            time.sleep(0.1)
+        # 开始录音
+        self.audio_handler.start_recording(backend="glm-4-voice" if is_voice_model else "speech_recognition")
         
-        # 检查当前是否使用语音模型
-        is_voice_model = self.current_api == self.zhipu_ai and self.current_api.model == "glm-4-voice"
+        # 等待录音结束：手动停止，或检测到说话后持续静音自动停止
+        self.audio_handler.wait_for_recording()
+        if self.audio_handler.is_recording:
+            self.audio_handler.stop_recording()
+            self.ui_queue.put(("voice_button", "开始语音"))
+            self.set_status("检测到静音，录音已自动停止，正在处理...")
         
-        if is_voice_model:
+        if not self.audio_handler.speech_detected:
+            self.set_status("未检测到语音")
+        elif is_voice_model:
             # 如果使用的是语音模型，不需要本地转文字，直接发送音频文件给API
-            self.status_var.set("录音完成，准备发送")
-            # 如果输入框为空，添加默认文本
-            if not self.input_text.get("1.0", tk.END).strip():
-                self.input_text.insert("1.0", "请处理这段语音")
-            # 调用发送函数
-            self.send_message()
+            self.set_status("录音完成，准备发送")
+            self.run_on_ui(self._send_voice_message)
         else:
             # 使用本地语音识别转换为文本
             text = self.audio_handler.speech_to_text()
             
             if text:
                 # 将转换后的文本添加到输入框
-                self.input_text.delete("1.0", tk.END)
-                self.input_text.insert("1.0", text)
-                self.status_var.set("语音已转换为文本")
+                self.set_input_text(text)
+                self.set_status("语音已转换为文本")
             else:
-                self.status_var.set("语音转换失败")
+                self.set_status("语音转换失败")
+    
+    def _send_voice_message(self):
+        """录音完成后发送给语音模型（在主线程中执行）"""
+        # 如果输入框为空，添加默认文本
+        if not self.input_text.get("1.0", tk.END).strip():
+            self.input_text.insert("1.0", "请处理这段语音")
+        # 调用发送函数
+        self.send_message()
+    
+    def show_partial_transcript(self, text):
+        """在输入框中实时显示边录音边识别的部分结果（由识别线程调用）"""
+        if not self.audio_handler.is_recording:
+            return
+        self.set_input_text(text)
+        self.set_status(f"识别中: {text}")
     
     def upload_file(self):
         """上传文件处理"""
@@ -391,19 +810,52 @@ class AIAssistantApp:
         
         if not file_path:
             return
-            
+        
+        # 大文档的提取可能耗时较长，在后台线程中进行，结果经界面更新队列返回
+        self.set_status(f"正在提取文件: {os.path.basename(file_path)}...")
+        threading.Thread(target=self._load_file, args=(file_path,), daemon=True).start()
+    
+    def _load_file(self, file_path):
+        """在后台线程中提取文件内容，较小的文件放入输入框，较大的文档进入文档模式"""
         try:
-            file_content = self.audio_handler.extract_text_from_file(file_path)
-            if file_content:
-                # 将文件内容添加到输入框
-                self.input_text.delete("1.0", tk.END)
-                self.input_text.insert("1.0", f"文件内容:\n{file_content}")
-                self.status_var.set(f"已加载文件: {os.path.basename(file_path)}")
-            else:
-                self.status_var.set("无法提取文件内容")
+            try:
+                document = self.audio_handler.extract_document(file_path)
+            except ValueError as e:
+                self.set_status(str(e))
+                return
+            file_content = document["text"]
+            if not file_content.strip():
+                self.set_status("无法提取文件内容")
+                return
+            
+            file_name = os.path.basename(file_path)
+            tokens = estimate_tokens(file_content)
+            if tokens <= self.document_inline_tokens:
+                # 较小的文件直接添加到输入框
+                self.set_input_text(f"文件内容:\n{file_content}")
+                self.set_status(f"已加载文件: {file_name}")
+                return
+            
+            # 较大的文档进入文档模式，分块大小不超过当前模型预算的一半
+            chunk_tokens = min(self.document_chunk_tokens, self.context_manager.get_budget(self.current_api.model) // 2)
+            chunks = chunk_text(file_content, chunk_tokens, document["page_offsets"])
+            active_document = {
+                "name": file_name,
+                "chunks": chunks,
+                "chunk_tokens": chunk_tokens,
+                "cache_key": document["cache_key"],
+                "tokens": tokens,
+                "index": None
+            }
+            notice = f"已加载文档《{file_name}》（约{tokens}个token，分为{len(chunks)}段），之后的问题将基于该文档回答，清空对话可退出文档模式。"
+            if document.get("truncated"):
+                notice += "文档超出提取上限的部分已省略。"
+            self.run_on_ui(setattr, self, "active_document", active_document)
+            self.add_message("系统", notice)
+            self.set_status(f"文档模式: {file_name}")
         except Exception as e:
-            messagebox.showerror("文件处理错误", str(e))
-            self.status_var.set("文件处理错误")
+            self.show_error("文件处理错误", str(e))
+            self.set_status("文件处理错误")
     
     def open_settings(self):
         """打开API设置对话框"""
@@ -441,15 +893,18 @@ class AIAssistantApp:
         self.zhipu_ai.api_key = self.zhipu_key_entry.get()
         self.deepseek_ai.api_key = self.deepseek_key_entry.get()
         
-        # 保存配置到文件
-        config = {
+        # 保存配置到文件，保留设置界面之外的配置项
+        config = dict(self.config)
+        config.update({
             "zhipu_api_key": self.zhipu_ai.api_key,
-            "deepseek_api_key": self.deepseek_ai.api_key
-        }
+            "deepseek_api_key": self.deepseek_ai.api_key,
+            "enable_failover": self.enable_failover
+        })
         
         try:
             with open("config.json", "w", encoding="utf-8") as f:
-                json.dump(config, f, indent=4)
+                json.dump(config, f, indent=4, ensure_ascii=False)
+            self.config = config
             messagebox.showinfo("成功", "设置已保存")
             window.destroy()
         except Exception as e:
@@ -462,19 +917,40 @@ class AIAssistantApp:
                 with open("config.json", "r", encoding="utf-8") as f:
                     config = json.load(f)
                 
+                self.config = config
                 self.zhipu_ai.api_key = config.get("zhipu_api_key", "")
                 self.deepseek_ai.api_key = config.get("deepseek_api_key", "")
+                self.enable_failover = config.get("enable_failover", True)
+                self.artifact_store.quota_bytes = int(config.get("temp_quota_mb", 200)) * 1024 * 1024
+                self.document_workers = config.get("document_workers", 3)
+                self.transcript.max_rendered = config.get("transcript_max_messages", 100)
+                self.transcript.collapse_file_contents = config.get("collapse_file_contents", True)
         except Exception as e:
             print(f"加载配置时出错: {str(e)}")
+        
+        # 语音识别后端："google"（默认，在线）或"vosk"（离线，需配置speech_backend_options.model_paths）
+        backend_name = self.config.get("speech_backend", "google")
+        if backend_name != self.audio_handler.recognizer_backend.name:
+            try:
+                backend = create_backend(backend_name, **self.config.get("speech_backend_options", {}))
+                self.audio_handler.set_recognizer_backend(backend)
+            except Exception as e:
+                print(f"初始化语音识别后端 {backend_name} 时出错，继续使用在线识别: {str(e)}")
     
     def clear_conversation(self):
         """清空对话历史"""
+        self.request_queue.clear_pending()
+        self.audio_handler.stop_speaking()
         self.conversation_history = []
+        self.context_manager.reset()
         self.last_audio_id = None  # 清除语音ID
-        self.conversation_text.config(state=tk.NORMAL)
-        self.conversation_text.delete("1.0", tk.END)
-        self.conversation_text.config(state=tk.DISABLED)
-        self.status_var.set("对话已清空")
+        self.active_document = None  # 退出文档模式
+        # 释放本次对话的语音文件，之后的文件归属新的对话
+        self.artifact_store.release(self.conversation_id)
+        self.conversation_id = uuid.uuid4().hex
+        # 经由界面更新队列清空，保证之前排队的消息不会出现在清空之后
+        self.ui_queue.put(("clear", None))
+        self.set_status("对话已清空")
 
 def main():
     root = tk.Tk()
@@ -482,4 +958,6 @@ def main():
     root.mainloop()
 
 if __name__ == "__main__":
+    # 打包为exe后，文档提取的进程池工作进程需要由此进入工作进程逻辑，而不是再启动一个界面
+    multiprocessing.freeze_support()
     main()
\ No newline at end of file
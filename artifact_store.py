@@ -0,0 +1,147 @@
+import os
+import threading
+import time
+
+
+class ArtifactStore:
+    """temp/目录下音频文件的生命周期管理
+
+    记录每个文件的所属者（对话）、大小和最近访问时间。对话清空后释放其文件，
+    总大小超过配额时按最近访问时间淘汰；删除由后台回收线程完成，不阻塞界面。
+    启动时已存在的文件没有所属者，超过orphan_ttl后被回收。
+    """
+
+    def __init__(self, root=None, quota_bytes=200 * 1024 * 1024, gc_interval=60, orphan_ttl=24 * 3600, grace_period=30):
+        """初始化并启动后台回收线程，默认管理程序目录下的temp"""
+        if root is None:
+            root = os.path.join(os.path.dirname(__file__), "temp")
+        os.makedirs(root, exist_ok=True)
+
+        self.root = root
+        self.quota_bytes = quota_bytes
+        self.gc_interval = gc_interval
+        self.orphan_ttl = orphan_ttl
+        self.grace_period = grace_period  # 刚访问过的文件可能正在播放，不参与配额淘汰
+
+        self._lock = threading.Lock()
+        self._entries = {}  # 路径 -> {"owner", "size", "accessed"}
+        self._released = set()  # 等待删除的路径
+        self._wakeup = threading.Event()
+        self.deleted = 0
+        self.freed_bytes = 0
+
+        self._adopt_existing()
+        threading.Thread(target=self._gc_loop, daemon=True).start()
+
+    def _adopt_existing(self):
+        """登记目录中已有的文件（不含子目录），作为无所属者的文件"""
+        for name in os.listdir(self.root):
+            path = os.path.join(self.root, name)
+            if os.path.isfile(path):
+                stat = os.stat(path)
+                self._entries[os.path.abspath(path)] = {
+                    "owner": None,
+                    "size": stat.st_size,
+                    "accessed": stat.st_mtime
+                }
+
+    def register(self, path, owner):
+        """登记一个文件及其所属者，已登记的文件改为新的所属者"""
+        if not path or not os.path.exists(path):
+            return path
+        key = os.path.abspath(path)
+        with self._lock:
+            self._entries[key] = {"owner": owner, "size": os.path.getsize(path), "accessed": time.time()}
+            self._released.discard(key)
+            over_quota = self._total_bytes() > self.quota_bytes
+        if over_quota:
+            self._wakeup.set()
+        return path
+
+    def touch(self, path):
+        """记录一次访问"""
+        with self._lock:
+            entry = self._entries.get(os.path.abspath(path))
+            if entry is not None:
+                entry["accessed"] = time.time()
+
+    def release(self, owner):
+        """释放某个所属者的全部文件，由后台线程删除，返回释放的文件数"""
+        with self._lock:
+            paths = [path for path, entry in self._entries.items() if entry["owner"] == owner]
+            self._released.update(paths)
+        if paths:
+            self._wakeup.set()
+        return len(paths)
+
+    def _total_bytes(self):
+        """已登记文件的总大小，调用时需持有锁"""
+        return sum(entry["size"] for entry in self._entries.values())
+
+    def collect(self):
+        """执行一次回收：删除已释放和过期的文件，再按最近访问时间淘汰到配额以内"""
+        now = time.time()
+        with self._lock:
+            victims = set(self._released)
+            for path, entry in self._entries.items():
+                if entry["owner"] is None and now - entry["accessed"] > self.orphan_ttl:
+                    victims.add(path)
+
+            total = self._total_bytes() - sum(self._entries[path]["size"] for path in victims if path in self._entries)
+            if total > self.quota_bytes:
+                candidates = sorted(
+                    (entry["accessed"], path) for path, entry in self._entries.items()
+                    if path not in victims and now - entry["accessed"] > self.grace_period
+                )
+                for _, path in candidates:
+                    if total <= self.quota_bytes:
+                        break
+                    victims.add(path)
+                    total -= self._entries[path]["size"]
+
+        # 在锁外删除文件，删除失败（例如正在播放）的文件留到下一轮
+        deleted = 0
+        freed = 0
+        for path in victims:
+            try:
+                if os.path.exists(path):
+                    os.unlink(path)
+            except OSError as e:
+                print(f"删除临时音频文件时出错: {str(e)}")
+                continue
+            with self._lock:
+                entry = self._entries.pop(path, None)
+                self._released.discard(path)
+            if entry is not None:
+                deleted += 1
+                freed += entry["size"]
+
+        if deleted:
+            self.deleted += deleted
+            self.freed_bytes += freed
+            print(f"已回收临时音频文件: {deleted}个，{freed / 1024:.1f}KB")
+        return {"deleted": deleted, "freed_bytes": freed}
+
+    def _gc_loop(self):
+        """后台回收线程：定期或在被唤醒时执行回收"""
+        while True:
+            self._wakeup.wait(self.gc_interval)
+            self._wakeup.clear()
+            try:
+                self.collect()
+            except Exception as e:
+                print(f"回收临时音频文件时出错: {str(e)}")
+
+    def stats(self):
+        """返回文件数、占用大小和累计回收情况"""
+        with self._lock:
+            count, total = len(self._entries), self._total_bytes()
+            released = len(self._released)
+        return {
+            "entries": count,
+            "bytes": total,
+            "quota_bytes": self.quota_bytes,
+            "released": released,
+            "deleted": self.deleted,
+            "freed_bytes": self.freed_bytes
+        }
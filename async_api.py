@@ -0,0 +1,113 @@
+import asyncio
+import threading
+import time
+
+from api_handler import ZhipuAI, DeepseekAI
+from resilience import APIError
+
+
+class EventLoopThread:
+    """在单独后台线程中运行的asyncio事件循环，供界面线程提交协程"""
+
+    def __init__(self):
+        """初始化事件循环线程"""
+        self.loop = None
+        self._thread = None
+        self._ready = threading.Event()
+        self._lock = threading.Lock()
+
+    def start(self):
+        """启动事件循环线程，重复调用不会创建新线程"""
+        with self._lock:
+            if self._thread is not None and self._thread.is_alive():
+                return
+            self._ready.clear()
+            self._thread = threading.Thread(target=self._run, daemon=True)
+            self._thread.start()
+        self._ready.wait()
+
+    def _run(self):
+        """线程入口，创建并一直运行事件循环"""
+        self.loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(self.loop)
+        self._ready.set()
+        self.loop.run_forever()
+        self.loop.close()
+
+    def submit(self, coro):
+        """提交协程到事件循环，返回concurrent.futures.Future"""
+        self.start()
+        return asyncio.run_coroutine_threadsafe(coro, self.loop)
+
+    def run(self, coro, timeout=None):
+        """提交协程并阻塞等待结果"""
+        return self.submit(coro).result(timeout)
+
+    def stop(self):
+        """停止事件循环"""
+        if self.loop is not None and self.loop.is_running():
+            self.loop.call_soon_threadsafe(self.loop.stop)
+
+
+class AsyncModelAPI:
+    """AIModelAPI的异步版本
+
+    同步API在事件循环的线程池中执行，继续复用各API类共享的HTTP连接池。
+    """
+
+    def __init__(self, api, name=None):
+        """包装一个同步的AIModelAPI实例"""
+        self.api = api
+        self.name = name or api.model
+
+    async def generate_response(self, messages):
+        """异步生成回复"""
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(None, self.api.generate_response, messages)
+
+    async def timed_response(self, messages):
+        """异步生成回复并记录耗时，返回包含模型名、回复和延迟的字典"""
+        start_time = time.perf_counter()
+        try:
+            response = await self.generate_response(messages)
+        except Exception as e:
+            response = APIError(getattr(self.api, "provider_name", self.name), "unknown", str(e))
+        return {
+            "name": self.name,
+            "response": response,
+            "latency": time.perf_counter() - start_time,
+            "ok": not isinstance(response, APIError)
+        }
+
+
+async def fan_out(apis, messages, mode="all"):
+    """把同一组消息并发发送给多个模型
+
+    mode为"first"时返回最先成功的一个结果（全部失败时返回最先完成的结果），
+    mode为"all"时按完成先后返回全部结果。
+    """
+    tasks = [asyncio.ensure_future(api.timed_response(messages)) for api in apis]
+    results = []
+    try:
+        for next_done in asyncio.as_completed(tasks):
+            result = await next_done
+            results.append(result)
+            if mode == "first" and result["ok"]:
+                return [result]
+    finally:
+        for task in tasks:
+            if not task.done():
+                task.cancel()
+
+    if mode == "first":
+        return results[:1]
+    return results
+
+
+def build_fanout_apis(zhipu_api_key, deepseek_api_key):
+    """创建用于并发对比的模型列表：GLM-4、GLM-3-Turbo和Deepseek"""
+    return [
+        AsyncModelAPI(ZhipuAI(api_key=zhipu_api_key, model="glm-4"), "GLM-4"),
+        AsyncModelAPI(ZhipuAI(api_key=zhipu_api_key, model="glm-3-turbo"), "GLM-3-Turbo"),
+        AsyncModelAPI(DeepseekAI(api_key=deepseek_api_key, model="deepseek-chat"), "Deepseek-Chat")
+    ]
@@ -0,0 +1,120 @@
+import base64
+import time
+
+import numpy as np
+
+
+def frame_rms(data):
+    """计算一段int16 PCM数据的均方根能量"""
+    samples = np.frombuffer(data, dtype=np.int16)
+    if samples.size == 0:
+        return 0.0
+    samples = samples.astype(np.float32)
+    return float(np.sqrt(np.mean(samples * samples)))
+
+
+def lowpass_kernel(taps, cutoff):
+    """Hamming窗sinc低通滤波器系数，cutoff为截止频率与采样率之比，直流增益为1"""
+    n = np.arange(taps) - (taps - 1) / 2
+    kernel = 2 * cutoff * np.sinc(2 * cutoff * n) * np.hamming(taps)
+    return (kernel / kernel.sum()).astype(np.float32)
+
+
+class StreamResampler:
+    """int16单声道PCM的流式重采样器
+
+    逐块输入设备采样率的数据，输出目标采样率的数据。降采样前先用加窗sinc低通滤波器
+    （截止频率略低于目标采样率的一半）抑制混叠，再线性插值；块与块之间保留滤波历史和插值位置，拼接处不会产生断点。
+    插值位置用整数分子（输出序号×src_rate）计算，分块处理的结果与整段处理逐样本相同。
+    """
+
+    def __init__(self, src_rate, dst_rate, taps=63, cutoff_ratio=0.9):
+        """初始化重采样器，taps为低通滤波器的阶数，cutoff_ratio为截止频率占目标奈奎斯特频率的比例"""
+        self.src_rate = src_rate
+        self.dst_rate = dst_rate
+        self.step = src_rate / dst_rate  # 每个输出样本对应的输入样本数
+        if dst_rate < src_rate:
+            self.kernel = lowpass_kernel(taps, cutoff_ratio * dst_rate / 2 / src_rate)
+        else:
+            self.kernel = np.ones(1, dtype=np.float32)
+        self._history = np.zeros(self.kernel.size - 1, dtype=np.float32)
+        self._previous = 0.0  # 上一块最后一个滤波后的样本
+        self._consumed = 0  # 已处理的输入样本总数
+        self._produced = 0  # 已输出的样本总数，第n个输出样本位于输入序列的n*src_rate/dst_rate处
+
+    def process(self, data):
+        """重采样一块int16 PCM数据，返回目标采样率的bytes"""
+        if self.src_rate == self.dst_rate:
+            return bytes(data)
+        samples = np.frombuffer(data, dtype=np.int16).astype(np.float32)
+        if samples.size == 0:
+            return b""
+
+        if self.kernel.size > 1:
+            padded = np.concatenate((self._history, samples))
+            filtered = np.convolve(padded, self.kernel, mode="valid")
+            self._history = padded[-(self.kernel.size - 1):]
+        else:
+            filtered = samples
+
+        # source[k]对应输入序列中第(base - 1 + k)个样本，首个元素是上一块的最后一个样本
+        base = self._consumed
+        last_index = base + filtered.size - 1
+        source = np.concatenate(([self._previous], filtered))
+        self._previous = filtered[-1]
+        self._consumed += filtered.size
+
+        # 位置不超过last_index的输出样本可以在本块内插值
+        end = last_index * self.dst_rate // self.src_rate + 1
+        if end <= self._produced:
+            return b""
+        numerators = np.arange(self._produced, end, dtype=np.int64) * self.src_rate
+        self._produced = end
+        indices = numerators // self.dst_rate
+        fractions = (numerators % self.dst_rate) / self.dst_rate
+        lower = indices - (base - 1)
+        upper = np.minimum(lower + 1, source.size - 1)  # 恰好落在last_index时权重为0
+        output = source[lower] * (1.0 - fractions) + source[upper] * fractions
+        return np.clip(np.rint(output), -32768, 32767).astype(np.int16).tobytes()
+
+
+def resample(data, src_rate, dst_rate):
+    """一次性重采样整段int16单声道PCM数据"""
+    return StreamResampler(src_rate, dst_rate).process(data)
+
+
+def benchmark(seconds=10, capture_rate=44100, target_rate=16000, chunk_size=1024):
+    """对比设备采样率和目标采样率下每轮语音的数据量和编码耗时"""
+    t = np.arange(int(seconds * capture_rate)) / capture_rate
+    # 用调幅的多个谐波近似语音信号
+    signal = (np.sin(2 * np.pi * 3 * t) * 0.5 + 0.5) * (
+        np.sin(2 * np.pi * 220 * t) + 0.5 * np.sin(2 * np.pi * 660 * t) + 0.25 * np.sin(2 * np.pi * 1320 * t)
+    )
+    pcm = (signal * 6000).astype(np.int16).tobytes()
+    chunk_bytes = chunk_size * 2
+
+    resampler = StreamResampler(capture_rate, target_rate)
+    start_time = time.perf_counter()
+    resampled = b"".join(resampler.process(pcm[i:i + chunk_bytes]) for i in range(0, len(pcm), chunk_bytes))
+    resample_time = time.perf_counter() - start_time
+
+    start_time = time.perf_counter()
+    encoded_full = base64.b64encode(pcm)
+    encode_full_time = time.perf_counter() - start_time
+    start_time = time.perf_counter()
+    encoded_target = base64.b64encode(resampled)
+    encode_target_time = time.perf_counter() - start_time
+
+    chunks = (len(pcm) + chunk_bytes - 1) // chunk_bytes
+    print(f"录音时长: {seconds}秒，{chunks}块，每块{chunk_size}帧")
+    print(f"PCM大小: {capture_rate}Hz {len(pcm)} 字节 -> {target_rate}Hz {len(resampled)} 字节 "
+          f"（减少 {1 - len(resampled) / len(pcm):.1%}）")
+    print(f"base64上传大小: {len(encoded_full)} -> {len(encoded_target)} 字节，"
+          f"每轮节省 {len(encoded_full) - len(encoded_target)} 字节")
+    print(f"重采样总耗时: {resample_time * 1000:.2f}毫秒（每块 {resample_time / chunks * 1e6:.1f}微秒，在录音回调中完成）")
+    print(f"base64编码耗时: {encode_full_time * 1000:.2f} -> {encode_target_time * 1000:.2f}毫秒")
+
+
+# 如果直接运行此文件，执行重采样基准测试
+if __name__ == "__main__":
+    benchmark()
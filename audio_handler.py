@@ -1,62 +1,105 @@
 import os
-import tempfile
 import wave
 import pyaudio
 import threading
-import speech_recognition as sr
-import pyttsx3
-import PyPDF2
-import docx
-import pygame
 import time
+import pygame
+from collections import deque
 from io import BytesIO
+from audio_dsp import frame_rms, StreamResampler
+from doc_extract import DocumentExtractor, EXTRACTOR_VERSION
+from extraction_cache import ExtractionCache, file_digest
+from playback import PlaybackManager
+from speech_backends import GoogleRecognizerBackend, BackgroundRecognizer, RecognitionError
+from tts_cache import TTSCache
+from tts_worker import TTSWorker
 
 class AudioHandler:
     """处理语音输入输出和文件文本提取"""
     
     def __init__(self):
         """初始化音频处理器"""
-        # 语音识别
-        self.recognizer = sr.Recognizer()
-        
-        # 文本到语音
-        self.tts_lock = threading.RLock()  # 添加线程锁，防止多线程同时访问TTS引擎
-        self.engine = None  # 不在初始化时创建引擎，改为按需创建
+        # 语音识别后端，可替换为离线或测试用的后端
+        self.recognizer_backend = GoogleRecognizerBackend()
         
         # 录音相关变量
         self.is_recording = False
         self.audio_frames = []
-        self.sample_rate = 44100  # 调整为更标准的采样率，提高兼容性
+        self.sample_rate = 44100  # 设备录音采样率，调整为更标准的采样率，提高兼容性
+        # 各识别后端需要的采样率：录音时按设备采样率采集，实时降采样后保存
+        self.target_rates = {
+            "speech_recognition": 16000,
+            "glm-4-voice": 16000
+        }
+        self.target_rate = self.sample_rate  # 当前录音保存和输出的采样率
+        self.resampler = None
+        self.target_rates["speech_recognition"] = self.recognizer_backend.sample_rate
         self.channels = 1
         self.chunk_size = 1024
         self.audio_format = pyaudio.paInt16
         self.audio = pyaudio.PyAudio()
         self.stream = None
-        self.temp_file = None
+        self.wav_data = None  # 最近一次录音的内存WAV数据
+        self.pcm_data = None  # 最近一次录音的PCM数据，供识别后端使用
+        self.speech_detected = False  # 最近一次录音中是否检测到说话
+        self.recording_lock = threading.Lock()
+        self.recording_done = threading.Event()  # 录音结束（手动停止或静音自动停止）时置位
+        
+        # 语音活动检测：按每块数据的能量判断是否在说话
+        self.vad_threshold = 500  # int16样本的均方根能量阈值
+        self.auto_stop = True  # 说话后持续静音时自动停止录音
+        self.silence_timeout_ms = 1500  # 说话后静音多久自动停止
+        self.no_speech_timeout_ms = 8000  # 一直没有检测到说话时多久自动停止
+        self.padding_ms = 200  # 裁剪首尾静音时保留的余量，避免截掉字头字尾
+        self._reset_vad()
+        
+        # 边录音边识别：回调中的数据经有界队列送入后台识别线程
+        self.streaming_recognition = True
+        self.partial_callback = None  # 部分识别结果回调，在后台线程中调用
+        self.background_recognizer = None
         
-        # 初始化pygame用于播放音频
+        # 文档提取：页数和字符数上限为None时提取全文，结果按文件内容缓存在cache/extraction
+        self.document_extractor = DocumentExtractor()
+        
+        self.extraction_cache = ExtractionCache()
+        
+        # 初始化pygame用于播放音频，所有播放经由同一个播放管理器排队
         pygame.mixer.init()
+        self.playback = PlaybackManager()
+        
+        # 文本到语音：常驻工作线程持有TTS引擎，逐句合成并流水线播放
+        # 合成结果按文本和合成参数缓存在temp/tts_cache，重复的句子直接播放
+        self.tts_cache = TTSCache()
+        self.tts_worker = TTSWorker(
+            self.play_audio_file,
+            self.stop_playback,
+            cache=self.tts_cache,
+            preload_func=self.playback.preload
+        )
     
-    def _get_tts_engine(self):
-        """获取或创建TTS引擎"""
-        with self.tts_lock:
-            if self.engine is None:
-                self.engine = pyttsx3.init()
-                self.engine.setProperty('rate', 180)  # 语速
-                self.engine.setProperty('volume', 1.0)  # 音量
-            return self.engine
-    
-    def start_recording(self):
-        """开始录音"""
+    def start_recording(self, backend="speech_recognition"):
+        """开始录音，backend决定录音保存和输出的采样率"""
         if self.is_recording:
             return
         
         self.is_recording = True
         self.audio_frames = []
+        self.wav_data = None
+        self.pcm_data = None
+        self.speech_detected = False
+        self.recording_done.clear()
+        self._reset_vad()
+        self.target_rate = self.target_rates.get(backend, self.sample_rate)
+        self.resampler = StreamResampler(self.sample_rate, self.target_rate)
         
-        # 创建临时文件用于保存录音
-        self.temp_file = tempfile.NamedTemporaryFile(suffix=".wav", delete=False)
-        self.temp_file.close()  # 立即关闭文件，避免资源问题
+        # 本地识别时在录音过程中同步识别，停止后几乎立即得到结果
+        self.background_recognizer = None
+        if backend == "speech_recognition" and self.streaming_recognition:
+            self.background_recognizer = BackgroundRecognizer(
+                self.recognizer_backend,
+                self.target_rate,
+                on_partial=self.partial_callback
+            ).start()
         
         # 创建录音流
         self.stream = self.audio.open(
@@ -71,236 +114,237 @@ class AudioHandler:
         # 开始录音
         self.stream.start_stream()
     
+    def _chunk_ms(self, frame_count):
+        """一块音频数据对应的毫秒数"""
+        return frame_count * 1000.0 / self.sample_rate
+    
+    def _reset_vad(self):
+        """重置语音活动检测状态"""
+        padding_chunks = max(1, int(self.padding_ms * self.sample_rate / 1000 / self.chunk_size))
+        self._preroll = deque(maxlen=padding_chunks)  # 开始说话前的最近几块数据
+        self._speech_started = False
+        self._last_voiced = 0  # 最后一块有声数据之后的帧数
+        self._silence_ms = 0.0
+        self._elapsed_ms = 0.0
+    
     def _record_callback(self, in_data, frame_count, time_info, status):
-        """录音回调函数"""
-        self.audio_frames.append(in_data)
+        """录音回调函数，检测语音活动并丢弃首尾静音"""
+        chunk_ms = self._chunk_ms(frame_count)
+        self._elapsed_ms += chunk_ms
+        voiced = frame_rms(in_data) >= self.vad_threshold
+        # 每块都经过重采样器，保证重采样状态连续，保存的是目标采样率的数据
+        frame = self.resampler.process(in_data)
+        
+        if not self._speech_started:
+            if voiced:
+                # 检测到说话，保留之前一小段数据作为起音余量
+                self._speech_started = True
+                self.audio_frames.extend(self._preroll)
+                if self.background_recognizer is not None:
+                    for preroll_frame in self._preroll:
+                        self.background_recognizer.feed(preroll_frame)
+                self._preroll.clear()
+            else:
+                self._preroll.append(frame)
+                if self.auto_stop and self._elapsed_ms >= self.no_speech_timeout_ms:
+                    return self._finish_from_callback(in_data)
+                return (in_data, pyaudio.paContinue)
+        
+        self.audio_frames.append(frame)
+        if self.background_recognizer is not None:
+            self.background_recognizer.feed(frame)
+        if voiced:
+            self._last_voiced = len(self.audio_frames)
+            self._silence_ms = 0.0
+        else:
+            self._silence_ms += chunk_ms
+            if self.auto_stop and self._silence_ms >= self.silence_timeout_ms:
+                return self._finish_from_callback(in_data)
         return (in_data, pyaudio.paContinue)
     
+    def _finish_from_callback(self, in_data):
+        """在回调中结束录音流，由等待线程调用stop_recording完成收尾"""
+        self.recording_done.set()
+        return (in_data, pyaudio.paComplete)
+    
+    def wait_for_recording(self, timeout=None):
+        """等待录音结束（手动停止或自动停止），返回是否已结束"""
+        return self.recording_done.wait(timeout)
+    
     def stop_recording(self):
         """停止录音"""
-        if not self.is_recording:
-            return
-        
-        self.is_recording = False
-        
-        # 停止录音流
-        if self.stream and self.stream.is_active():
-            self.stream.stop_stream()
-            self.stream.close()
-            self.stream = None
-        
-        # 将录音数据写入临时文件
-        try:
-            with wave.open(self.temp_file.name, 'wb') as wf:
-                wf.setnchannels(self.channels)
-                wf.setsampwidth(self.audio.get_sample_size(self.audio_format))
-                wf.setframerate(self.sample_rate)
-                wf.writeframes(b''.join(self.audio_frames))
+        with self.recording_lock:
+            if not self.is_recording:
+                return
             
-            # 确保文件完全写入
-            time.sleep(0.1)
-        except Exception as e:
-            print(f"保存音频文件时出错: {str(e)}")
+            self.is_recording = False
+            
+            # 停止录音流（静音自动停止时流已处于完成状态，同样需要关闭）
+            if self.stream:
+                if self.stream.is_active():
+                    self.stream.stop_stream()
+                self.stream.close()
+                self.stream = None
+            
+            # 通知后台识别线程录音已结束；没有检测到说话时直接放弃识别，不向识别后端提交空录音
+            self.speech_detected = self._speech_started
+            if self.background_recognizer is not None:
+                if self.speech_detected:
+                    self.background_recognizer.close()
+                else:
+                    self.background_recognizer.cancel()
+                    self.background_recognizer = None
+            
+            # 裁剪尾部静音，保留少量余量
+            padding_chunks = self._preroll.maxlen
+            frames = self.audio_frames[:self._last_voiced + padding_chunks] if self._speech_started else []
+            self.audio_frames = []
+            
+            # 在内存中把录音数据编码为WAV，不再经过临时文件
+            try:
+                if frames:
+                    self.pcm_data = b''.join(frames)
+                    buffer = BytesIO()
+                    with wave.open(buffer, 'wb') as wf:
+                        wf.setnchannels(self.channels)
+                        wf.setsampwidth(self.audio.get_sample_size(self.audio_format))
+                        wf.setframerate(self.target_rate)
+                        wf.writeframes(self.pcm_data)
+                    self.wav_data = buffer.getvalue()
+                else:
+                    print("未检测到说话，录音已丢弃")
+            except Exception as e:
+                print(f"编码录音数据时出错: {str(e)}")
+            finally:
+                self.recording_done.set()
     
-    def get_audio_file_path(self):
-        """获取录制的音频文件路径"""
-        if self.temp_file and os.path.exists(self.temp_file.name):
-            return self.temp_file.name
-        return None
+    def get_audio_bytes(self):
+        """获取最近一次录音的WAV数据（BytesIO），没有录音时返回None"""
+        if not self.wav_data:
+            return None
+        # BytesIO直接共享bytes对象的缓冲区，不会复制录音数据
+        return BytesIO(self.wav_data)
+    
+    def set_recognizer_backend(self, backend):
+        """更换语音识别后端，录音采样率随之调整"""
+        self.recognizer_backend = backend
+        self.target_rates["speech_recognition"] = backend.sample_rate
     
     def speech_to_text(self):
-        """将录音转换为文本"""
-        if not self.temp_file or not os.path.exists(self.temp_file.name):
-            return "未找到录音文件"
-        
-        file_path = self.temp_file.name
+        """将录音转换为文本，没有检测到说话时返回None"""
+        if not self.speech_detected:
+            return None
+        if not self.pcm_data:
+            return "未找到录音数据"
             
         try:
-            # 确保文件已完全写入并关闭
-            time.sleep(0.2)
-            
-            # 创建一个新的识别器实例，避免潜在的状态问题
-            recognizer = sr.Recognizer()
-            
-            # 尝试使用本地语音识别
-            with sr.AudioFile(file_path) as source:
-                audio_data = recognizer.record(source)
-                
-                # 首选中文识别，fallback到英文
-                try:
-                    text = recognizer.recognize_google(audio_data, language='zh-CN')
-                    return text
-                except sr.UnknownValueError:
-                    try:
-                        # 尝试英文识别
-                        text = recognizer.recognize_google(audio_data, language='en-US')
-                        return text
-                    except:
-                        return "无法识别语音内容"
-                except sr.RequestError as e:
-                    return f"语音识别服务错误: {str(e)}"
-        except sr.UnknownValueError:
-            return "无法识别语音"
-        except sr.RequestError as e:
+            # 优先使用边录音边识别得到的结果，不可用时对完整录音识别
+            result = None
+            if self.background_recognizer is not None:
+                result = self.background_recognizer.wait_result()
+                self.background_recognizer = None
+            if result is None:
+                # 由识别后端一次完成语言判断和识别
+                result = self.recognizer_backend.recognize(self.pcm_data, self.target_rate)
+            if not result.get("text"):
+                return "无法识别语音内容"
+            print(f"语音识别完成: 后端={self.recognizer_backend.name}, 语言={result.get('language')}, 置信度={result.get('confidence', 0):.2f}")
+            return result["text"]
+        except RecognitionError as e:
             return f"语音识别服务错误: {str(e)}"
         except Exception as e:
             # 保存更详细的错误信息
             error_msg = f"转换语音时出错: {str(e)}"
             print(error_msg)
-            # 检查文件状态
-            try:
-                file_size = os.path.getsize(file_path)
-                print(f"音频文件大小: {file_size} 字节")
-                if file_size == 0:
-                    return "录音文件为空，请重新录制"
-            except:
-                pass
+            print(f"录音数据大小: {len(self.pcm_data)} 字节")
             return error_msg
     
     def clean_temp_files(self):
-        """清理临时文件"""
-        if self.temp_file and os.path.exists(self.temp_file.name):
-            try:
-                os.unlink(self.temp_file.name)
-            except Exception as e:
-                print(f"删除临时文件时出错: {str(e)}")
-            self.temp_file = None
+        """释放当前录音数据"""
+        self.audio_frames = []
+        self.wav_data = None
+        self.pcm_data = None
     
     def text_to_speech(self, text):
-        """将文本转换为语音输出，使用本地TTS引擎"""
+        """将文本加入本地TTS朗读队列，第一句合成完即开始播放"""
         try:
-            # 使用临时文件存储合成的语音
-            temp_dir = os.path.join(os.path.dirname(__file__), "temp")
-            if not os.path.exists(temp_dir):
-                os.makedirs(temp_dir)
-                
-            # 使用wav格式而非mp3，因为pyttsx3更好地支持wav格式
-            temp_file = os.path.join(temp_dir, f"tts_{int(time.time())}.wav")
-            
-            print(f"正在合成语音到: {temp_file}")
-            
-            # 在单独的线程中运行TTS引擎，避免阻塞主线程
-            def synthesize_speech():
-                with self.tts_lock:
-                    try:
-                        engine = self._get_tts_engine()
-                        # 防止引擎已经被初始化但未被正确清理
-                        if hasattr(engine, '_inLoop') and engine._inLoop:
-                            print("TTS引擎已在运行中，重新初始化...")
-                            self.engine = None
-                            engine = self._get_tts_engine()
-                            
-                        # 设置属性
-                        engine.setProperty('rate', 180)  # 语速
-                        engine.setProperty('volume', 1.0)  # 音量
-                        
-                        # 保存为WAV文件
-                        print("正在将文本保存为音频文件...")
-                        engine.save_to_file(text, temp_file)
-                        engine.runAndWait()
-                        
-                        print("语音合成完成，等待文件写入...")
-                        # 等待文件写入完成
-                        time.sleep(0.8)
-                        
-                        # 播放合成的音频文件
-                        if os.path.exists(temp_file):
-                            print(f"开始播放合成的语音文件: {temp_file}")
-                            success = self.play_audio_file(temp_file)
-                            if success:
-                                print("语音播放完成")
-                            else:
-                                print("语音播放失败")
-                            
-                            # 延迟删除临时文件，确保播放完毕
-                            time.sleep(0.5)
-                            try:
-                                if os.path.exists(temp_file):
-                                    os.unlink(temp_file)
-                                    print(f"临时文件已删除: {temp_file}")
-                            except Exception as e:
-                                print(f"删除临时文件时出错: {str(e)}")
-                    except Exception as e:
-                        print(f"语音合成错误 (详细): {str(e)}")
-                        import traceback
-                        traceback.print_exc()
-            
-            # 启动语音合成线程
-            speech_thread = threading.Thread(target=synthesize_speech)
-            speech_thread.daemon = True
-            speech_thread.start()
+            self.tts_worker.speak(text)
             return True
         except Exception as e:
             print(f"语音合成错误: {str(e)}")
             return False
     
+    def speak_sentence(self, sentence):
+        """把一个已切分好的句子加入朗读队列，用于边接收回复边朗读"""
+        self.tts_worker.enqueue(sentence)
+    
+    def stop_speaking(self):
+        """停止朗读和语音回复的播放，丢弃尚未播放的内容"""
+        self.tts_worker.cancel()
+        self.playback.stop()
+    
+    def stop_playback(self):
+        """停止当前正在播放的音频"""
+        self.playback.skip()
+    
     def play_audio_file(self, file_path):
-        """播放音频文件"""
-        if not file_path or not os.path.exists(file_path):
-            print(f"音频文件不存在: {file_path}")
-            return False
-            
-        try:
-            print(f"开始播放音频文件: {file_path}")
-            # 检查文件大小，确保不是空文件
-            file_size = os.path.getsize(file_path)
-            if file_size == 0:
-                print("音频文件为空，无法播放")
-                return False
-                
-            # 确保pygame已初始化
-            if not pygame.mixer.get_init():
-                pygame.mixer.init(frequency=44100)
-                
-            # 尝试停止任何正在播放的音频
-            if pygame.mixer.music.get_busy():
-                pygame.mixer.music.stop()
-                
-            # 使用pygame播放音频
-            pygame.mixer.music.load(file_path)
-            pygame.mixer.music.play()
-            
-            # 输出音频时长信息
-            try:
-                with wave.open(file_path, 'rb') as wav_file:
-                    frames = wav_file.getnframes()
-                    rate = wav_file.getframerate()
-                    duration = frames / float(rate)
-                    print(f"音频时长: {duration:.2f}秒")
-            except:
-                pass
-                
-            # 等待播放完成
-            print("等待音频播放完成...")
-            while pygame.mixer.music.get_busy():
-                pygame.time.Clock().tick(10)
-                
-            print("音频播放已完成")
-            return True
-        except Exception as e:
-            print(f"播放音频文件时出错: {str(e)}")
-            import traceback
-            traceback.print_exc()
-            return False
+        """播放音频文件，阻塞到播放结束，返回是否完整播放"""
+        return self.playback.play(file_path).wait()
     
     def extract_text_from_file(self, file_path):
         """从文件中提取文本内容"""
+        try:
+            result = self.extract_document(file_path)
+        except ValueError as e:
+            return str(e)
+        except Exception as e:
+            return f"提取文本时出错: {str(e)}"
+        
+        text = result["text"]
+        if result.get("truncated"):
+            text += "\n... (文档较长，超出提取上限的内容已省略) ..."
+        return text
+    
+    def extract_document(self, file_path):
+        """提取文档，返回{"text", "page_offsets", "truncated", "seconds", "cache_key"}
+        
+        PDF和Word文档的提取结果按文件内容缓存，重复上传时直接读取。
+        """
         # 获取文件扩展名
         _, ext = os.path.splitext(file_path)
         ext = ext.lower()
+        if ext not in ('.txt', '.pdf', '.docx'):
+            raise ValueError(f"不支持的文件类型: {ext}")
         
-        try:
-            # 根据文件类型调用不同的提取方法
-            if ext == '.txt':
-                return self._extract_from_txt(file_path)
-            elif ext == '.pdf':
-                return self._extract_from_pdf(file_path)
-            elif ext == '.docx':
-                return self._extract_from_docx(file_path)
-            else:
-                return f"不支持的文件类型: {ext}"
-        except Exception as e:
-            return f"提取文本时出错: {str(e)}"
+        extractor = self.document_extractor
+        cache_key = self.extraction_cache.make_key(
+            file_digest(file_path),
+            EXTRACTOR_VERSION,
+            ext=ext,
+            max_pages=extractor.max_pages,
+            max_chars=extractor.max_chars
+        )
+        if ext != '.txt':
+            result = self.extraction_cache.get(cache_key, os.path.getsize(file_path))
+            if result is not None:
+                print(f"使用缓存的提取结果: {os.path.basename(file_path)}")
+                result["cache_key"] = cache_key
+                return result
+        
+        # 根据文件类型调用不同的提取方法
+        start_time = time.perf_counter()
+        if ext == '.txt':
+            result = {"text": self._extract_from_txt(file_path), "page_offsets": [0], "truncated": False}
+        elif ext == '.pdf':
+            result = self._extract_from_pdf(file_path)
+        else:
+            result = self._extract_from_docx(file_path)
+        result["seconds"] = time.perf_counter() - start_time
+        
+        if ext != '.txt':
+            self.extraction_cache.put(cache_key, result)
+        result["cache_key"] = cache_key
+        return result
     
     def _extract_from_txt(self, file_path):
         """从txt文件提取文本"""
@@ -313,36 +357,17 @@ class AudioHandler:
                 return f.read()
     
     def _extract_from_pdf(self, file_path):
-        """从PDF文件提取文本"""
-        text = ""
-        with open(file_path, 'rb') as f:
-            pdf_reader = PyPDF2.PdfReader(f)
-            num_pages = len(pdf_reader.pages)
-            
-            # 读取每一页内容
-            for page_num in range(num_pages):
-                page = pdf_reader.pages[page_num]
-                text += page.extract_text() + "\n"
-                
-                # 如果文本太长，只提取前10页
-                if page_num >= 9:
-                    text += "\n... (文档较长，只显示前10页) ..."
-                    break
-        
-        return text
+        """从PDF文件提取文本，页数较多时并行提取"""
+        result = self.document_extractor.extract_pdf(file_path)
+        page_seconds = result["page_seconds"]
+        if page_seconds:
+            slowest = max(range(len(page_seconds)), key=page_seconds.__getitem__)
+            print(f"PDF提取完成: {len(page_seconds)}页，耗时 {result['seconds']:.2f}秒，"
+                  f"最慢为第{slowest + 1}页 {page_seconds[slowest] * 1000:.1f}毫秒")
+        return result
     
     def _extract_from_docx(self, file_path):
-        """从Word文档提取文本"""
-        doc = docx.Document(file_path)
-        text = ""
-        
-        # 读取文档的段落
-        for para in doc.paragraphs:
-            text += para.text + "\n"
-            
-            # 如果文本太长，只提取部分内容
-            if len(text) > 5000:
-                text += "\n... (文档较长，只显示部分内容) ..."
-                break
-        
-        return text
\ No newline at end of file
+        """从Word文档按原有顺序提取段落和表格文本"""
+        result = self.document_extractor.extract_docx(file_path)
+        print(f"Word文档提取完成: {result['blocks']}个段落和表格行，耗时 {result['seconds']:.2f}秒")
+        return result
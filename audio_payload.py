@@ -0,0 +1,170 @@
+import base64
+import hashlib
+import json
+import os
+import re
+import threading
+import uuid
+from collections import OrderedDict
+
+
+class EncodedAudio:
+    """请求体中的一段base64语音数据
+
+    序列化请求体时按块编码输出，不需要把整段base64字符串和JSON拼接在内存中。
+    """
+
+    def __init__(self, key, encoded=None, raw=None, file_path=None, chunk_size=192 * 1024):
+        """encoded为已缓存的base64数据；否则从raw（内存数据）或file_path分块编码"""
+        self.key = key
+        self.encoded = encoded
+        self.raw = raw
+        self.file_path = file_path
+        # 每块原始数据的大小必须是3的倍数，保证分块编码的结果可以直接拼接
+        self.chunk_size = chunk_size - chunk_size % 3
+
+    def iter_base64(self):
+        """分块产出base64编码后的bytes"""
+        if self.encoded is not None:
+            view = memoryview(self.encoded)
+            step = self.chunk_size // 3 * 4
+            for start in range(0, len(view), step):
+                yield view[start:start + step]
+        elif self.raw is not None:
+            view = memoryview(self.raw)
+            for start in range(0, len(view), self.chunk_size):
+                yield base64.b64encode(view[start:start + self.chunk_size])
+        else:
+            with open(self.file_path, "rb") as f:
+                while True:
+                    chunk = f.read(self.chunk_size)
+                    if not chunk:
+                        break
+                    yield base64.b64encode(chunk)
+
+    def __str__(self):
+        """用于计算缓存键和请求去重，只包含语音数据的标识"""
+        return f"<audio {self.key}>"
+
+
+class EncodedAudioCache:
+    """语音base64编码结果的缓存
+
+    文件按(路径, 修改时间, 大小)作为键，内存数据按内容摘要作为键，
+    使历史中较早轮次的语音不必在每次请求时重新读取和编码。按总字节数LRU淘汰，
+    超过单条上限的大录音不进入缓存，发送时直接从源数据分块编码。
+    """
+
+    def __init__(self, max_bytes=32 * 1024 * 1024, max_item_bytes=8 * 1024 * 1024):
+        """初始化缓存"""
+        self.max_bytes = max_bytes
+        self.max_item_bytes = max_item_bytes
+        self._entries = OrderedDict()
+        self._total_bytes = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, message):
+        """获取消息中语音数据的EncodedAudio对象"""
+        raw = message.get("audio_data")
+        if raw is not None:
+            if hasattr(raw, "getbuffer"):
+                raw = raw.getbuffer()
+            # 内容摘要缓存在消息上，避免每轮重新计算
+            digest = message.get("_audio_digest")
+            if digest is None:
+                digest = hashlib.sha1(raw).hexdigest()
+                message["_audio_digest"] = digest
+            key = f"mem:{digest}"
+            size = len(raw)
+            file_path = None
+        else:
+            file_path = message["audio_file"]
+            stat = os.stat(file_path)
+            key = f"file:{file_path}:{stat.st_mtime_ns}:{stat.st_size}"
+            size = stat.st_size
+
+        with self._lock:
+            encoded = self._entries.get(key)
+            if encoded is not None:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return EncodedAudio(key, encoded=encoded)
+            self.misses += 1
+
+        if size > self.max_item_bytes:
+            return EncodedAudio(key, raw=raw, file_path=file_path)
+
+        if raw is None:
+            with open(file_path, "rb") as f:
+                raw = f.read()
+        encoded = base64.b64encode(raw)
+        self._store(key, encoded)
+        return EncodedAudio(key, encoded=encoded)
+
+    def _store(self, key, encoded):
+        """写入缓存并按LRU淘汰"""
+        with self._lock:
+            if key in self._entries:
+                return
+            self._entries[key] = encoded
+            self._total_bytes += len(encoded)
+            while self._total_bytes > self.max_bytes and len(self._entries) > 1:
+                _, evicted = self._entries.popitem(last=False)
+                self._total_bytes -= len(evicted)
+
+    def clear(self):
+        """清空缓存"""
+        with self._lock:
+            self._entries.clear()
+            self._total_bytes = 0
+
+
+def contains_encoded_audio(data):
+    """请求体的消息中是否包含EncodedAudio"""
+    for message in data.get("messages", []):
+        content = message.get("content")
+        if isinstance(content, list):
+            for part in content:
+                if isinstance(part.get("input_audio", {}).get("data"), EncodedAudio):
+                    return True
+    return False
+
+
+def iter_json_body(data):
+    """流式序列化JSON请求体，EncodedAudio以分块base64字符串写出
+
+    EncodedAudio先被替换为唯一的占位字符串，标准JSON编码器输出其余部分，
+    遇到占位字符串时改为逐块输出语音数据。
+    """
+    marker = uuid.uuid4().hex
+    audios = []
+
+    def replace(value):
+        if isinstance(value, EncodedAudio):
+            audios.append(value)
+            return f"{marker}:{len(audios) - 1}"
+        if isinstance(value, dict):
+            return {k: replace(v) for k, v in value.items()}
+        if isinstance(value, list):
+            return [replace(v) for v in value]
+        return value
+
+    placeholder = re.compile(f'"{marker}:(\\d+)"')
+    encoder = json.JSONEncoder(ensure_ascii=False)
+    for chunk in encoder.iterencode(replace(data)):
+        if marker not in chunk:
+            yield chunk.encode("utf-8")
+            continue
+        position = 0
+        for match in placeholder.finditer(chunk):
+            # 空块在分块传输编码中表示结束，这里只输出非空内容
+            if match.start() > position:
+                yield chunk[position:match.start()].encode("utf-8")
+            yield b'"'
+            yield from audios[int(match.group(1))].iter_base64()
+            yield b'"'
+            position = match.end()
+        if position < len(chunk):
+            yield chunk[position:].encode("utf-8")
@@ -0,0 +1,129 @@
+import math
+
+
+def estimate_tokens(text):
+    """粗略估算文本的token数：中日韩字符约1个token，其他字符约4个字符1个token"""
+    if not text:
+        return 0
+    cjk_count = sum(1 for char in text if ord(char) >= 0x2E80)
+    return cjk_count + math.ceil((len(text) - cjk_count) / 4)
+
+
+class ContextManager:
+    """对话上下文管理器
+
+    按模型的token预算只发送最近的一段对话，更早的对话折叠为一条摘要消息，
+    使每轮请求的大小不随会话长度增长。
+    """
+
+    # 各模型发送历史的token预算（包含摘要）
+    model_budgets = {
+        "glm-4": 6000,
+        "glm-3-turbo": 6000,
+        "glm-4-voice": 2000,
+        "deepseek-chat": 6000,
+        "deepseek-coder": 6000
+    }
+    default_budget = 4000
+
+    message_overhead = 4  # 每条消息的角色、分隔符等额外开销
+    audio_tokens = 300  # 带语音文件的消息按固定开销估算
+    summary_line_chars = 80  # 折叠时每条消息保留的字符数
+
+    def __init__(self, model_budgets=None, summary_budget=500, summarizer=None):
+        """初始化上下文管理器
+
+        summarizer为可选的摘要函数，签名为summarizer(previous_summary, messages)，
+        返回新的摘要文本；未提供时使用本地的截取式摘要。
+        """
+        self.model_budgets = dict(self.model_budgets)
+        if model_budgets:
+            self.model_budgets.update(model_budgets)
+        self.summary_budget = summary_budget
+        self.summarizer = summarizer
+        self.reset()
+
+    def reset(self):
+        """清空摘要缓存，清空对话时调用"""
+        self._folded_count = 0  # 已折叠进摘要的历史消息数
+        self._summary_text = ""
+
+    def get_budget(self, model):
+        """获取模型的token预算"""
+        return self.model_budgets.get(model, self.default_budget)
+
+    def message_tokens(self, message):
+        """估算单条消息的token数，结果缓存在消息的_token_cache字段中"""
+        content = message.get("content") or ""
+        cached = message.get("_token_cache")
+        # 内容被替换（例如流式回复拼接完成）后重新估算
+        if cached is not None and cached[0] is content:
+            return cached[1]
+
+        tokens = estimate_tokens(content) + self.message_overhead
+        if message.get("audio_file") or message.get("audio_data"):
+            tokens += self.audio_tokens
+        message["_token_cache"] = (content, tokens)
+        return tokens
+
+    def build_messages(self, history, model=None, budget=None):
+        """返回本轮需要发送的消息列表：摘要消息加上预算内最近的对话"""
+        if budget is None:
+            budget = self.get_budget(model)
+
+        # 历史被清空或替换后，之前的摘要已不再适用
+        if self._folded_count > len(history):
+            self.reset()
+
+        # 从最新的消息往前累加，直到超出预算（为摘要预留空间）
+        window_budget = budget - self.summary_budget
+        used = 0
+        start = len(history)
+        while start > self._folded_count:
+            tokens = self.message_tokens(history[start - 1])
+            if used + tokens > window_budget and start < len(history):
+                break
+            used += tokens
+            start -= 1
+
+        # 窗口以用户消息开头，避免把半轮对话发送给模型
+        while start < len(history) - 1 and history[start]["role"] != "user":
+            start += 1
+
+        if start > self._folded_count:
+            self._fold(history[self._folded_count:start])
+            self._folded_count = start
+
+        window = list(history[self._folded_count:])
+        if self._summary_text:
+            window.insert(0, {
+                "role": "system",
+                "content": f"以下是之前对话的摘要：\n{self._summary_text}"
+            })
+        return window
+
+    def _fold(self, messages):
+        """把较早的消息折叠进缓存的摘要中"""
+        if self.summarizer is not None:
+            try:
+                self._summary_text = self.summarizer(self._summary_text, messages)
+                return
+            except Exception as e:
+                print(f"生成对话摘要时出错，改用本地摘要: {str(e)}")
+
+        lines = self._summary_text.split("\n") if self._summary_text else []
+        for message in messages:
+            speaker = "用户" if message["role"] == "user" else "助手"
+            content = " ".join((message.get("content") or "").split())
+            if len(content) > self.summary_line_chars:
+                content = content[:self.summary_line_chars] + "…"
+            lines.append(f"{speaker}: {content}")
+
+        # 超出摘要预算时丢弃最早的摘要行
+        line_tokens = [estimate_tokens(line) + 1 for line in lines]
+        total = sum(line_tokens)
+        first = 0
+        while total > self.summary_budget and first < len(lines) - 1:
+            total -= line_tokens[first]
+            first += 1
+        self._summary_text = "\n".join(lines[first:])
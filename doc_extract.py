@@ -0,0 +1,228 @@
+import os
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import docx
+import PyPDF2
+from docx.oxml.ns import qn
+from docx.table import Table
+from docx.text.paragraph import Paragraph
+
+# 提取逻辑变化时加一，使旧的提取缓存失效
+EXTRACTOR_VERSION = 3
+
+def _extract_pdf_batch(file_path, page_numbers):
+    """在工作进程中提取一批页面，返回[(页码, 文本, 耗时秒)]"""
+    results = []
+    with open(file_path, 'rb') as f:
+        pdf_reader = PyPDF2.PdfReader(f)
+        for page_num in page_numbers:
+            start_time = time.perf_counter()
+            text = pdf_reader.pages[page_num].extract_text() or ""
+            results.append((page_num, text, time.perf_counter() - start_time))
+    return results
+
+
+def _iter_docx_elements(parent_element, parent):
+    """按文档顺序产出(类型, 文本)，表格逐行输出，单元格内的嵌套表格同样展开"""
+    for child in parent_element.iterchildren():
+        if child.tag == qn("w:p"):
+            yield "paragraph", Paragraph(child, parent).text
+        elif child.tag == qn("w:tbl"):
+            table = Table(child, parent)
+            # 合并单元格（横向和纵向）在每个被合并的位置重复出现，整个表格中只保留一次；
+            # 集合中保存元素本身而不是id()，元素代理对象被回收后id可能被复用
+            seen = set()
+            for row in table.rows:
+                cells = []
+                nested = []
+                for cell in row.cells:
+                    if cell._tc in seen or cell._tc.vMerge == "continue":
+                        continue
+                    seen.add(cell._tc)
+                    cell_texts = []
+                    for kind, text in _iter_docx_elements(cell._tc, cell):
+                        if kind == "paragraph":
+                            cell_texts.append(text)
+                        else:
+                            nested.append((kind, text))
+                    cells.append(" ".join(text for text in cell_texts if text))
+                if any(cells):
+                    yield "table_row", " | ".join(cells)
+                yield from nested
+
+
+def count_pdf_pages(file_path):
+    """读取PDF的总页数"""
+    with open(file_path, 'rb') as f:
+        return len(PyPDF2.PdfReader(f).pages)
+
+
+class DocumentExtractor:
+    """文档文本提取引擎
+
+    PDF按页逐个产出，页数较多时把页面分批交给进程池并行提取，结果仍按页码顺序返回。
+    max_pages和max_chars限制提取的页数和字符数（None表示不限制），
+    达到限制后停止提交新的页面。每页记录提取耗时，便于定位慢页面。
+    """
+
+    def __init__(self, max_pages=None, max_chars=None, max_workers=None, batch_pages=8, parallel_min_pages=16):
+        """初始化提取引擎，页数少于parallel_min_pages时在当前进程中提取，避免进程池的启动开销"""
+        self.max_pages = max_pages
+        self.max_chars = max_chars
+        self.max_workers = max_workers or max(1, min(4, (os.cpu_count() or 1)))
+        self.batch_pages = batch_pages
+        self.parallel_min_pages = parallel_min_pages
+        self._pool = None
+
+    def _get_pool(self):
+        """进程池按需创建并复用"""
+        if self._pool is None:
+            self._pool = ProcessPoolExecutor(max_workers=self.max_workers)
+        return self._pool
+
+    def close(self):
+        """关闭进程池"""
+        if self._pool is not None:
+            if sys.version_info >= (3, 9):
+                self._pool.shutdown(wait=False, cancel_futures=True)
+            else:
+                self._pool.shutdown(wait=False)
+            self._pool = None
+
+    def _iter_pdf_batches(self, file_path, page_count):
+        """按页码顺序产出(页码, 文本, 耗时)，大文档在进程池中并行提取"""
+        batches = [
+            list(range(start, min(start + self.batch_pages, page_count)))
+            for start in range(0, page_count, self.batch_pages)
+        ]
+        if page_count < self.parallel_min_pages or self.max_workers <= 1:
+            for batch in batches:
+                yield from _extract_pdf_batch(file_path, batch)
+            return
+
+        pool = self._get_pool()
+        # 同时在途的批次数有上限，调用方提前停止时不会白白提取整份文档
+        window = self.max_workers * 2
+        futures = []
+        next_batch = 0
+        try:
+            while next_batch < len(batches) or futures:
+                while next_batch < len(batches) and len(futures) < window:
+                    futures.append(pool.submit(_extract_pdf_batch, file_path, batches[next_batch]))
+                    next_batch += 1
+                yield from futures.pop(0).result()
+        finally:
+            for future in futures:
+                future.cancel()
+
+    def iter_pdf_pages(self, file_path):
+        """逐页产出{"page", "text", "seconds"}，达到页数或字符数上限时在最后一项标记truncated"""
+        total_pages = count_pdf_pages(file_path)
+        page_count = total_pages if self.max_pages is None else min(total_pages, self.max_pages)
+        chars = 0
+        pages = self._iter_pdf_batches(file_path, page_count)
+        try:
+            for page_num, text, seconds in pages:
+                page = {"page": page_num, "text": text, "seconds": seconds, "truncated": False}
+                if self.max_chars is not None and chars + len(text) >= self.max_chars:
+                    page["text"] = text[:self.max_chars - chars]
+                    page["truncated"] = chars + len(text) > self.max_chars or page_num + 1 < total_pages
+                    yield page
+                    return
+                chars += len(text)
+                if page_num + 1 == page_count and page_count < total_pages:
+                    page["truncated"] = True
+                yield page
+        finally:
+            pages.close()
+
+    def iter_docx_blocks(self, file_path):
+        """按文档顺序逐个产出段落和表格行{"kind", "text", "truncated"}，达到字符数上限时停止"""
+        document = docx.Document(file_path)
+        chars = 0
+        for kind, text in _iter_docx_elements(document.element.body, document):
+            block = {"kind": kind, "text": text, "truncated": False}
+            if self.max_chars is not None and chars + len(text) + 1 > self.max_chars:
+                block["text"] = text[:max(0, self.max_chars - chars)]
+                block["truncated"] = True
+                yield block
+                return
+            chars += len(text) + 1
+            yield block
+
+    def extract_docx(self, file_path):
+        """提取整份Word文档（含表格），返回与extract_pdf相同格式的结果"""
+        start_time = time.perf_counter()
+        parts = []
+        truncated = False
+        blocks = 0
+        for block in self.iter_docx_blocks(file_path):
+            parts.append(block["text"])
+            truncated = block["truncated"]
+            blocks += 1
+        text = "\n".join(parts)
+        if parts:
+            text += "\n"
+        return {
+            "text": text,
+            "page_offsets": [0],
+            "page_seconds": [],
+            "blocks": blocks,
+            "truncated": truncated,
+            "seconds": time.perf_counter() - start_time
+        }
+
+    def extract_pdf(self, file_path):
+        """提取整份PDF，返回文本、每页起始偏移、每页耗时和是否被截断"""
+        start_time = time.perf_counter()
+        parts = []
+        page_offsets = []
+        page_seconds = []
+        truncated = False
+        offset = 0
+        for page in self.iter_pdf_pages(file_path):
+            page_offsets.append(offset)
+            page_seconds.append(page["seconds"])
+            parts.append(page["text"])
+            parts.append("\n")
+            offset += len(page["text"]) + 1
+            truncated = page["truncated"]
+        return {
+            "text": "".join(parts),
+            "page_offsets": page_offsets,
+            "page_seconds": page_seconds,
+            "truncated": truncated,
+            "seconds": time.perf_counter() - start_time
+        }
+
+
+def benchmark(sizes=(500, 1000, 2000, 4000)):
+    """生成不同规模的Word文档（段落和表格各半），测量提取吞吐量是否随文档大小线性变化"""
+    import tempfile
+
+    extractor = DocumentExtractor()
+    print(f"{'段落数':>8} {'表格行数':>8} {'字符数':>10} {'耗时(秒)':>10} {'吞吐量(字符/秒)':>16}")
+    with tempfile.TemporaryDirectory() as temp_dir:
+        for size in sizes:
+            document = docx.Document()
+            for i in range(size):
+                document.add_paragraph(f"第{i}段：合同条款示例文本，用于测试文档提取的吞吐量。Clause {i} sample text.")
+            table = document.add_table(rows=0, cols=3)
+            for i in range(size):
+                cells = table.add_row().cells
+                cells[0].text = f"项目{i}"
+                cells[1].text = f"数量 {i * 3}"
+                cells[2].text = f"备注：第{i}行"
+            file_path = os.path.join(temp_dir, f"bench_{size}.docx")
+            document.save(file_path)
+
+            result = extractor.extract_docx(file_path)
+            chars = len(result["text"])
+            print(f"{size:>8} {size:>8} {chars:>10} {result['seconds']:>10.3f} {chars / result['seconds']:>16.0f}")
+
+
+# 如果直接运行此文件，执行Word文档提取基准测试
+if __name__ == "__main__":
+    benchmark()
@@ -0,0 +1,126 @@
+import heapq
+import math
+import re
+from collections import Counter
+
+# 索引格式或分词规则变化时加一，使磁盘上的旧索引失效
+INDEX_VERSION = 2
+
+_TOKEN_PATTERN = re.compile(r"[a-z0-9]+|[\u3040-\u30ff\u3400-\u9fff\uf900-\ufaff]+")
+
+# 提问中常见的泛指词，不代表具体内容；中文停用词把连续的汉字切开，不与相邻的字组成bigram
+STOPWORDS = {
+    "the", "a", "an", "of", "to", "in", "on", "for", "and", "or", "is", "are", "was", "be",
+    "what", "which", "how", "why", "this", "that", "these", "it", "me", "please", "about",
+    "document", "file", "summarize", "summary", "tell", "explain", "describe"
+}
+CJK_STOPWORDS = [
+    "总结", "概括", "归纳", "介绍", "一下", "这个", "这篇", "这份", "文档", "文件", "文章", "全文",
+    "内容", "主要", "讲了", "说了", "什么", "哪些", "怎么", "如何", "是否", "请问", "帮我", "关于",
+    "一个", "我们", "你们", "请", "的", "了", "吗", "呢", "吧", "啥", "和", "与", "及", "是", "在", "有", "我", "你"
+]
+_CJK_STOP_PATTERN = re.compile("|".join(sorted(CJK_STOPWORDS, key=len, reverse=True)))
+
+
+def tokenize(text):
+    """分词：英文和数字按单词切分，中日文字去除停用词后按相邻两字（bigram）切分，单字成词时保留单字"""
+    tokens = []
+    for match in _TOKEN_PATTERN.finditer(text.lower()):
+        word = match.group()
+        if word[0] < "\u3040":
+            if word not in STOPWORDS:
+                tokens.append(word)
+            continue
+        for piece in _CJK_STOP_PATTERN.split(word):
+            if len(piece) == 1:
+                tokens.append(piece)
+            else:
+                tokens.extend(piece[i:i + 2] for i in range(len(piece) - 1))
+    return tokens
+
+
+class BM25Index:
+    """文档分块的BM25倒排索引
+
+    每个分块分词后记录词频，查询时只遍历查询词的倒排列表，按BM25得分返回最相关的分块。
+    """
+
+    def __init__(self, chunks=None, k1=1.5, b=0.75):
+        """初始化，提供chunks（chunk_text的结果）时立即建立索引"""
+        self.k1 = k1
+        self.b = b
+        self.chunks = []
+        self.postings = {}  # 词 -> [[分块序号, 词频], ...]
+        self.doc_lengths = []
+        self.average_length = 0.0
+        if chunks:
+            self.build(chunks)
+
+    def build(self, chunks):
+        """建立索引"""
+        self.chunks = [
+            {"text": chunk["text"], "page": chunk.get("page", 1), "tokens": chunk.get("tokens", 0)}
+            for chunk in chunks
+        ]
+        self.postings = {}
+        self.doc_lengths = []
+        for doc_id, chunk in enumerate(self.chunks):
+            terms = tokenize(chunk["text"])
+            self.doc_lengths.append(len(terms))
+            for term, count in Counter(terms).items():
+                self.postings.setdefault(term, []).append([doc_id, count])
+        self.average_length = sum(self.doc_lengths) / len(self.doc_lengths) if self.doc_lengths else 0.0
+
+    def search(self, query, k=4, min_score=0.0):
+        """返回得分最高的k个分块[(得分, 分块序号, 分块)]，没有得分达到min_score的分块时返回空列表"""
+        doc_count = len(self.chunks)
+        if not doc_count:
+            return []
+        scores = {}
+        for term in set(tokenize(query)):
+            postings = self.postings.get(term)
+            if not postings:
+                continue
+            idf = math.log(1 + (doc_count - len(postings) + 0.5) / (len(postings) + 0.5))
+            for doc_id, count in postings:
+                length_norm = 1 - self.b + self.b * self.doc_lengths[doc_id] / (self.average_length or 1)
+                score = idf * count * (self.k1 + 1) / (count + self.k1 * length_norm)
+                scores[doc_id] = scores.get(doc_id, 0.0) + score
+        best = heapq.nlargest(k, ((doc_id, score) for doc_id, score in scores.items() if score >= min_score),
+                              key=lambda item: item[1])
+        return [(score, doc_id, self.chunks[doc_id]) for doc_id, score in best]
+
+    def to_dict(self):
+        """转换为可以JSON序列化的字典"""
+        return {
+            "version": INDEX_VERSION,
+            "k1": self.k1,
+            "b": self.b,
+            "chunks": self.chunks,
+            "postings": self.postings,
+            "doc_lengths": self.doc_lengths
+        }
+
+    @classmethod
+    def from_dict(cls, data):
+        """从to_dict的结果恢复索引"""
+        index = cls(k1=data["k1"], b=data["b"])
+        index.chunks = data["chunks"]
+        index.postings = data["postings"]
+        index.doc_lengths = data["doc_lengths"]
+        index.average_length = sum(index.doc_lengths) / len(index.doc_lengths) if index.doc_lengths else 0.0
+        return index
+
+
+def load_or_build_index(cache, cache_key, chunks, chunk_tokens):
+    """从提取缓存旁加载文档的检索索引，不存在时建立并保存"""
+    suffix = f"bm25-{chunk_tokens}"
+    data = cache.read(cache_key, suffix)
+    if data is not None and data.get("version") == INDEX_VERSION:
+        return BM25Index.from_dict(data)
+    index = BM25Index(chunks)
+    try:
+        cache.write(cache_key, index.to_dict(), suffix)
+    except OSError as e:
+        print(f"保存检索索引时出错: {str(e)}")
+    return index
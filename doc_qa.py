@@ -0,0 +1,183 @@
+import bisect
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+from context_manager import estimate_tokens
+from resilience import APIError
+
+
+def chunk_text(text, max_tokens=1500, page_offsets=None):
+    """按段落把文本切分为不超过max_tokens的分块
+
+    返回[{"index", "text", "start", "page", "tokens"}]，start为分块在原文中的起始偏移，
+    提供page_offsets时page为分块起始位置所在的页码（从1开始）。
+    """
+    chunks = []
+    parts = []
+    part_tokens = 0
+    chunk_start = 0
+
+    def flush(next_start):
+        nonlocal parts, part_tokens, chunk_start
+        chunk = "".join(parts).strip()
+        if chunk:
+            page = bisect.bisect_right(page_offsets, chunk_start) if page_offsets else 1
+            chunks.append({
+                "index": len(chunks),
+                "text": chunk,
+                "start": chunk_start,
+                "page": max(page, 1),
+                "tokens": part_tokens
+            })
+        parts = []
+        part_tokens = 0
+        chunk_start = next_start
+
+    position = 0
+    for line in text.splitlines(keepends=True):
+        line_tokens = estimate_tokens(line)
+        if line_tokens > max_tokens:
+            # 超长段落按估算的字符数硬切分
+            flush(position)
+            step = max(1, int(len(line) * max_tokens / line_tokens))
+            for start in range(0, len(line), step):
+                parts.append(line[start:start + step])
+                part_tokens = estimate_tokens(parts[0])
+                flush(position + min(start + step, len(line)))
+        else:
+            if part_tokens + line_tokens > max_tokens:
+                flush(position)
+            parts.append(line)
+            part_tokens += line_tokens
+        position += len(line)
+    flush(position)
+    return chunks
+
+
+class DocumentQA:
+    """基于分块的文档问答（map-reduce）
+
+    map阶段把问题和每个分块并发发送给模型（并发数有上限），得到各分块的局部回答；
+    reduce阶段把与问题相关的局部回答合并为一个完整回复，局部回答过多时分组逐级合并。
+    分析失败的分块超过max_failed_ratio时放弃回答，否则在回答末尾注明失败的段数。
+    """
+
+    no_answer = "无相关内容"
+    map_prompt = (
+        "你是文档分析助手。只根据下面给出的文档片段回答问题，引用关键原文并注明页码；"
+        f"如果片段中没有与问题相关的信息，只回复“{no_answer}”。"
+    )
+    reduce_prompt = "下面是从同一份文档的不同部分得到的局部回答，请去除重复、解决矛盾，合并为一个完整、有条理的回答。"
+
+    def __init__(self, api, max_workers=3, reduce_tokens=3000, max_failed_ratio=0.1):
+        """初始化，api为提供generate_response(messages)的模型接口"""
+        self.api = api
+        self.max_workers = max_workers
+        self.reduce_tokens = reduce_tokens
+        self.max_failed_ratio = max_failed_ratio
+
+    def _map_chunk(self, question, chunk, total):
+        """针对一个分块回答问题"""
+        messages = [
+            {"role": "system", "content": self.map_prompt},
+            {
+                "role": "user",
+                "content": f"文档片段（第{chunk['index'] + 1}/{total}段，第{chunk['page']}页起）：\n"
+                           f"{chunk['text']}\n\n问题：{question}"
+            }
+        ]
+        return self.api.generate_response(messages)
+
+    def _reduce(self, question, answers, history):
+        """合并一组局部回答"""
+        joined = "\n\n".join(f"【局部回答{i + 1}】\n{answer}" for i, answer in enumerate(answers))
+        messages = [{"role": "system", "content": self.reduce_prompt}]
+        messages.extend(history or [])
+        messages.append({"role": "user", "content": f"{joined}\n\n问题：{question}"})
+        return self.api.generate_response(messages)
+
+    def answer(self, question, chunks, history=None, progress=None):
+        """回答关于文档的问题，返回回复文本或APIError
+
+        history为附带在合并阶段的近期对话，progress(阶段, 已完成数, 总数)用于报告进度。
+        """
+        total = len(chunks)
+        answers = [None] * total
+        errors = []
+        done = 0
+        if progress is not None:
+            progress("map", 0, total)
+
+        with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+            futures = {executor.submit(self._map_chunk, question, chunk, total): chunk["index"] for chunk in chunks}
+            for future in as_completed(futures):
+                index = futures[future]
+                try:
+                    result = future.result()
+                except Exception as e:
+                    result = APIError(getattr(self.api, "provider_name", "模型"), "unknown", str(e))
+                if isinstance(result, APIError):
+                    errors.append(result)
+                else:
+                    answers[index] = result
+                done += 1
+                if progress is not None:
+                    progress("map", done, total)
+
+        failed = len(errors)
+        if failed and failed > total * self.max_failed_ratio:
+            # 失败的分块过多时合并结果不可信，直接报错
+            first = errors[0]
+            return APIError(
+                first.provider,
+                first.kind,
+                f"文档共{total}段，其中{failed}段分析失败（{first.detail}），已放弃回答",
+                status_code=first.status_code,
+                retryable=first.retryable
+            )
+
+        relevant = [
+            answer.strip() for answer in answers
+            if answer and not answer.strip().startswith(self.no_answer)
+        ]
+        result = self._combine(question, relevant, history, progress)
+        if failed and not isinstance(result, APIError):
+            result += f"\n\n（注意：文档共{total}段，其中{failed}段分析失败，以上回答未包含这些部分的内容。）"
+        return result
+
+    def _combine(self, question, relevant, history, progress):
+        """合并与问题相关的局部回答，返回回复文本或APIError"""
+        if not relevant:
+            return "文档中没有找到与问题相关的内容。"
+        if len(relevant) == 1:
+            return relevant[0]
+
+        # 局部回答超出预算时分组合并，直到可以一次合并
+        level = 0
+        while True:
+            groups = []
+            group = []
+            group_tokens = 0
+            for answer in relevant:
+                tokens = estimate_tokens(answer)
+                if group and group_tokens + tokens > self.reduce_tokens:
+                    groups.append(group)
+                    group = []
+                    group_tokens = 0
+                group.append(answer)
+                group_tokens += tokens
+            groups.append(group)
+
+            level += 1
+            if progress is not None:
+                progress("reduce", level, len(groups))
+            if len(groups) == 1 or len(groups) == len(relevant):
+                # 单个局部回答已超出预算时无法继续分组，直接合并
+                return self._reduce(question, relevant, history)
+
+            merged = []
+            for group in groups:
+                result = self._reduce(question, group, None) if len(group) > 1 else group[0]
+                if isinstance(result, APIError):
+                    return result
+                merged.append(result)
+            relevant = merged
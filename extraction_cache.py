@@ -0,0 +1,157 @@
+import hashlib
+import json
+import os
+import threading
+import time
+import zlib
+
+
+def file_digest(file_path, block_size=1024 * 1024):
+    """分块计算文件内容的SHA-256摘要"""
+    digest = hashlib.sha256()
+    with open(file_path, "rb") as f:
+        while True:
+            block = f.read(block_size)
+            if not block:
+                break
+            digest.update(block)
+    return digest.hexdigest()
+
+
+class ExtractionCache:
+    """文档提取结果的磁盘缓存
+
+    以文件内容摘要、提取器版本和提取参数作为键，提取结果（文本、每页偏移等）
+    经zlib压缩后保存在cache/extraction目录，重复上传同一文档时直接读取。
+    按最近访问时间（LRU）淘汰，总大小不超过上限。
+    """
+
+    def __init__(self, cache_dir=None, max_bytes=200 * 1024 * 1024):
+        """初始化缓存，默认保存在程序目录下的cache/extraction"""
+        if cache_dir is None:
+            cache_dir = os.path.join(os.path.dirname(__file__), "cache", "extraction")
+        os.makedirs(cache_dir, exist_ok=True)
+
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self.bytes_saved = 0  # 命中时免于重新解析的源文件字节数
+        self.seconds_saved = 0.0  # 命中时免去的提取耗时
+
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def make_key(digest, version, **options):
+        """根据文件摘要、提取器版本和提取参数计算缓存键"""
+        serialized = json.dumps([digest, version, options], sort_keys=True, separators=(",", ":"))
+        return hashlib.sha256(serialized.encode("utf-8")).hexdigest()
+
+    def path_for(self, key, suffix="result"):
+        """缓存键对应的文件路径，同一文档的其他数据（如检索索引）使用不同后缀保存在一起"""
+        return os.path.join(self.cache_dir, f"{key}.{suffix}.z")
+
+    def read(self, key, suffix="result"):
+        """读取并解压一项数据，不存在或损坏时返回None"""
+        path = self.path_for(key, suffix)
+        try:
+            with open(path, "rb") as f:
+                value = json.loads(zlib.decompress(f.read()).decode("utf-8"))
+        except (OSError, ValueError, zlib.error):
+            return None
+        try:
+            os.utime(path, (time.time(), time.time()))
+        except OSError:
+            pass
+        return value
+
+    def write(self, key, value, suffix="result"):
+        """压缩并原子地写入一项数据"""
+        path = self.path_for(key, suffix)
+        data = zlib.compress(json.dumps(value, ensure_ascii=False).encode("utf-8"), 6)
+        temp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(temp_path, "wb") as f:
+            f.write(data)
+        os.replace(temp_path, path)
+        return len(data)
+
+    def get(self, key, source_size=0):
+        """查找提取结果，未命中时返回None"""
+        result = self.read(key)
+        with self._lock:
+            if result is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+                self.bytes_saved += source_size
+                self.seconds_saved += result.get("seconds", 0.0)
+        return result
+
+    def put(self, key, result):
+        """写入提取结果并按需淘汰旧条目"""
+        self.write(key, result)
+        with self._lock:
+            self._evict()
+
+    def _evict(self):
+        """按最近访问时间删除文件直到满足大小上限，调用时需持有锁"""
+        entries = []
+        total = 0
+        for name in os.listdir(self.cache_dir):
+            if not name.endswith(".z"):
+                continue
+            stat = os.stat(os.path.join(self.cache_dir, name))
+            entries.append((stat.st_mtime, name, stat.st_size))
+            total += stat.st_size
+        if total <= self.max_bytes:
+            return
+
+        # 同一文档的各项数据一起淘汰
+        by_key = {}
+        for mtime, name, size in entries:
+            key = name.split(".", 1)[0]
+            accessed, key_size = by_key.get(key, (0.0, 0))
+            by_key[key] = (max(accessed, mtime), key_size + size)
+        for accessed, key in sorted((accessed, key) for key, (accessed, _) in by_key.items()):
+            if total <= self.max_bytes:
+                break
+            for _, name, size in entries:
+                if name.startswith(key + "."):
+                    try:
+                        os.unlink(os.path.join(self.cache_dir, name))
+                    except OSError:
+                        continue
+            total -= by_key[key][1]
+
+    def clear(self):
+        """清空缓存和统计"""
+        with self._lock:
+            for name in os.listdir(self.cache_dir):
+                if name.endswith(".z"):
+                    try:
+                        os.unlink(os.path.join(self.cache_dir, name))
+                    except OSError:
+                        pass
+            self.hits = 0
+            self.misses = 0
+            self.bytes_saved = 0
+            self.seconds_saved = 0.0
+
+    def stats(self):
+        """返回命中率、条目数、占用大小和节省的解析量"""
+        with self._lock:
+            names = [name for name in os.listdir(self.cache_dir) if name.endswith(".result.z")]
+            total = sum(
+                os.path.getsize(os.path.join(self.cache_dir, name))
+                for name in os.listdir(self.cache_dir) if name.endswith(".z")
+            )
+            lookups = self.hits + self.misses
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / lookups if lookups else 0.0,
+                "entries": len(names),
+                "bytes": total,
+                "bytes_saved": self.bytes_saved,
+                "seconds_saved": self.seconds_saved
+            }
@@ -0,0 +1,182 @@
+import os
+import queue
+import threading
+from collections import OrderedDict
+
+import pygame
+
+
+class PlaybackHandle:
+    """一次播放请求，可以等待完成或取消"""
+
+    def __init__(self, file_path, on_done=None):
+        """初始化，on_done(handle)在播放结束、被打断或失败时调用"""
+        self.file_path = file_path
+        self.on_done = on_done
+        self.completed = False  # 是否完整播放
+        self.generation = 0
+        self.done = threading.Event()
+        self._stop = threading.Event()
+
+    def cancel(self):
+        """停止或取消这次播放"""
+        self._stop.set()
+
+    def wait(self, timeout=None):
+        """等待播放结束，返回是否完整播放"""
+        self.done.wait(timeout)
+        return self.completed
+
+    def _finish(self, completed):
+        """标记结束并通知回调"""
+        self.completed = completed
+        self.done.set()
+        if self.on_done is not None:
+            try:
+                self.on_done(self)
+            except Exception as e:
+                print(f"播放完成回调出错: {str(e)}")
+
+
+class PlaybackManager:
+    """音频播放管理
+
+    所有播放请求进入同一个队列，由播放线程在保留的混音通道上依次播放，
+    不再争用全局的pygame.mixer.music。音频预先解码为Sound，短句可以立即开始播放；
+    播放线程按Sound的时长等待停止事件，不轮询播放状态。
+    """
+
+    # 播放结束时通道状态可能略晚于时长更新，最多再等待这么多次、每次tail_step秒
+    tail_checks = 20
+    tail_step = 0.01
+
+    def __init__(self, max_preloaded=8):
+        """初始化并启动播放线程，max_preloaded为预解码音频的缓存数量"""
+        self.max_preloaded = max_preloaded
+        self._sounds = OrderedDict()  # 文件路径 -> Sound
+        self._sounds_lock = threading.Lock()
+        self._queue = queue.Queue()
+        self._current = None
+        self._generation = 0  # 每次stop加一，之前提交的播放全部作废
+        self._lock = threading.Lock()
+        self._channel = None
+        threading.Thread(target=self._run, daemon=True).start()
+
+    def preload(self, file_path):
+        """预先解码音频文件，之后播放时无需加载"""
+        with self._sounds_lock:
+            sound = self._sounds.get(file_path)
+            if sound is not None:
+                self._sounds.move_to_end(file_path)
+                return sound
+        self._ensure_mixer()
+        sound = pygame.mixer.Sound(file_path)
+        with self._sounds_lock:
+            self._sounds[file_path] = sound
+            while len(self._sounds) > self.max_preloaded:
+                self._sounds.popitem(last=False)
+        return sound
+
+    def play(self, file_path, on_done=None, preempt=False):
+        """加入播放队列并立即返回PlaybackHandle；preempt为True时先打断当前和排队中的播放"""
+        handle = PlaybackHandle(file_path, on_done)
+        if preempt:
+            self.stop()
+        with self._lock:
+            handle.generation = self._generation
+        self._queue.put(handle)
+        return handle
+
+    def stop(self):
+        """停止当前播放并取消所有排队中的播放"""
+        with self._lock:
+            self._generation += 1
+        while True:
+            try:
+                pending = self._queue.get_nowait()
+            except queue.Empty:
+                break
+            pending._finish(False)
+        with self._lock:
+            if self._current is not None:
+                self._current.cancel()
+
+    def skip(self):
+        """只停止当前播放，继续播放队列中的下一个"""
+        with self._lock:
+            if self._current is not None:
+                self._current.cancel()
+
+    def is_playing(self):
+        """是否有正在播放的音频"""
+        with self._lock:
+            return self._current is not None
+
+    @staticmethod
+    def _ensure_mixer():
+        """确保pygame混音器已初始化"""
+        if not pygame.mixer.get_init():
+            pygame.mixer.init(frequency=44100)
+
+    def _get_channel(self):
+        """获取保留给本管理器的混音通道"""
+        if self._channel is None:
+            self._ensure_mixer()
+            pygame.mixer.set_reserved(1)
+            self._channel = pygame.mixer.Channel(0)
+        return self._channel
+
+    def _take_sound(self, file_path):
+        """取出预解码的Sound，没有时现场解码"""
+        with self._sounds_lock:
+            sound = self._sounds.pop(file_path, None)
+        if sound is None:
+            sound = self.preload(file_path)
+            with self._sounds_lock:
+                self._sounds.pop(file_path, None)
+        return sound
+
+    def _play_one(self, handle):
+        """播放一个音频，返回是否完整播放"""
+        if not handle.file_path or not os.path.exists(handle.file_path) or os.path.getsize(handle.file_path) == 0:
+            print(f"音频文件不存在或为空: {handle.file_path}")
+            return False
+
+        sound = self._take_sound(handle.file_path)
+        channel = self._get_channel()
+        duration = sound.get_length()
+        print(f"开始播放音频文件: {handle.file_path}，时长: {duration:.2f}秒")
+        channel.play(sound)
+
+        if handle._stop.wait(duration):
+            channel.stop()
+            return False
+        # 时长到达后通道可能还在输出最后一个缓冲区
+        for _ in range(self.tail_checks):
+            if not channel.get_busy():
+                break
+            if handle._stop.wait(self.tail_step):
+                channel.stop()
+                return False
+        return True
+
+    def _run(self):
+        """播放线程：依次播放队列中的音频"""
+        while True:
+            handle = self._queue.get()
+            with self._lock:
+                cancelled = handle._stop.is_set() or handle.generation != self._generation
+                if not cancelled:
+                    self._current = handle
+            if cancelled:
+                handle._finish(False)
+                continue
+            completed = False
+            try:
+                completed = self._play_one(handle)
+            except Exception as e:
+                print(f"播放音频文件时出错: {str(e)}")
+            finally:
+                with self._lock:
+                    self._current = None
+                handle._finish(completed)
@@ -0,0 +1,129 @@
+import hashlib
+import json
+import queue
+import threading
+
+
+def payload_key(*parts):
+    """根据请求内容计算稳定的键，用于识别相同的请求"""
+    serialized = json.dumps(parts, sort_keys=True, ensure_ascii=False, separators=(",", ":"), default=str)
+    return hashlib.sha256(serialized.encode("utf-8")).hexdigest()
+
+
+class _Call:
+    """一次正在进行中的调用"""
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+
+class SingleFlight:
+    """合并并发的相同请求：同一个键同时只执行一次，其余调用等待并共享结果"""
+
+    def __init__(self):
+        """初始化"""
+        self._calls = {}
+        self._lock = threading.Lock()
+        self.executed = 0  # 实际执行的次数
+        self.shared = 0  # 直接共享结果的次数
+
+    def do(self, key, fn, *args, **kwargs):
+        """执行fn，若相同键的调用正在进行则等待其结果"""
+        with self._lock:
+            call = self._calls.get(key)
+            if call is not None:
+                self.shared += 1
+                leader = False
+            else:
+                call = _Call()
+                self._calls[key] = call
+                self.executed += 1
+                leader = True
+
+        if not leader:
+            call.done.wait()
+        else:
+            try:
+                call.result = fn(*args, **kwargs)
+            except BaseException as e:
+                call.error = e
+            finally:
+                with self._lock:
+                    del self._calls[key]
+                call.done.set()
+
+        if call.error is not None:
+            raise call.error
+        return call.result
+
+
+class RequestQueue:
+    """对话请求队列
+
+    由单个工作线程按提交顺序串行处理，保证每轮对话依次修改历史记录；
+    排队或处理中的相同请求会被忽略，不会重复发送。
+    """
+
+    def __init__(self, max_pending=8):
+        """初始化请求队列"""
+        self.max_pending = max_pending
+        self._queue = queue.Queue()
+        self._pending = set()  # 排队和处理中的请求键
+        self._lock = threading.Lock()
+        self._worker = None
+
+    def is_pending(self, key):
+        """相同的请求是否正在排队或处理中"""
+        with self._lock:
+            return key in self._pending
+
+    def is_full(self):
+        """排队和处理中的请求是否已达到上限"""
+        with self._lock:
+            return len(self._pending) >= self.max_pending
+
+    def submit(self, key, fn, *args):
+        """提交请求，重复或队列已满时返回False"""
+        with self._lock:
+            if key in self._pending or len(self._pending) >= self.max_pending:
+                return False
+            self._pending.add(key)
+            if self._worker is None or not self._worker.is_alive():
+                self._worker = threading.Thread(target=self._run, daemon=True)
+                self._worker.start()
+        self._queue.put((key, fn, args))
+        return True
+
+    def clear_pending(self):
+        """丢弃尚未开始处理的请求，返回丢弃的数量"""
+        dropped = 0
+        while True:
+            try:
+                key, _, _ = self._queue.get_nowait()
+            except queue.Empty:
+                break
+            with self._lock:
+                self._pending.discard(key)
+            self._queue.task_done()
+            dropped += 1
+        return dropped
+
+    def pending_count(self):
+        """排队和处理中的请求数量"""
+        with self._lock:
+            return len(self._pending)
+
+    def _run(self):
+        """工作线程：依次取出并执行请求"""
+        while True:
+            key, fn, args = self._queue.get()
+            try:
+                fn(*args)
+            except Exception as e:
+                print(f"处理请求时出错: {str(e)}")
+            finally:
+                with self._lock:
+                    self._pending.discard(key)
+                self._queue.task_done()
@@ -0,0 +1,137 @@
+import random
+import threading
+import time
+from email.utils import parsedate_to_datetime
+
+
+class APIError(Exception):
+    """模型API调用失败时返回的错误对象
+
+    kind表示错误类别：config（未配置密钥）、audio（语音文件处理失败）、
+    http（服务端返回错误状态码）、network（网络异常）、circuit_open（熔断中）、
+    invalid_response（响应无法解析）。retryable表示该错误是否值得重试或切换服务商。
+    """
+
+    def __init__(self, provider, kind, detail, status_code=None, retryable=False):
+        """初始化错误对象"""
+        super().__init__(detail)
+        self.provider = provider
+        self.kind = kind
+        self.detail = detail
+        self.status_code = status_code
+        self.retryable = retryable
+
+    def __str__(self):
+        """返回适合在界面上显示的错误信息"""
+        if self.kind in ("config", "audio"):
+            return self.detail
+        return f"API调用错误: {self.detail}"
+
+    def __repr__(self):
+        return f"APIError(provider={self.provider!r}, kind={self.kind!r}, status_code={self.status_code!r}, detail={self.detail!r})"
+
+
+class RetryPolicy:
+    """带随机抖动的指数退避重试策略"""
+
+    def __init__(self, max_retries=3, base_delay=0.5, max_delay=8.0, max_retry_after=30.0,
+                 retry_statuses=(429, 500, 502, 503, 504)):
+        """初始化重试策略"""
+        self.max_retries = max_retries
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.max_retry_after = max_retry_after
+        self.retry_statuses = frozenset(retry_statuses)
+
+    def is_retryable_status(self, status_code):
+        """判断状态码是否需要重试"""
+        return status_code in self.retry_statuses
+
+    def compute_delay(self, attempt, retry_after=None):
+        """计算第attempt次重试前的等待时间，优先遵循服务端的Retry-After"""
+        server_delay = self.parse_retry_after(retry_after)
+        if server_delay is not None:
+            return min(server_delay, self.max_retry_after)
+        # full jitter：在[0, 上限]之间随机取值，避免多个客户端同时重试
+        return random.uniform(0, min(self.max_delay, self.base_delay * (2 ** attempt)))
+
+    @staticmethod
+    def parse_retry_after(value):
+        """解析Retry-After头，支持秒数和HTTP日期两种格式"""
+        if not value:
+            return None
+        try:
+            return max(float(value), 0.0)
+        except ValueError:
+            pass
+        try:
+            retry_at = parsedate_to_datetime(value)
+            return max(retry_at.timestamp() - time.time(), 0.0)
+        except (TypeError, ValueError):
+            return None
+
+
+class CircuitBreaker:
+    """服务商级别的熔断器
+
+    连续失败达到阈值后进入打开状态，直接拒绝请求；冷却时间过后进入半开状态，
+    放行一个探测请求，成功则恢复，失败则重新打开。
+    """
+
+    CLOSED = "closed"
+    OPEN = "open"
+    HALF_OPEN = "half_open"
+
+    def __init__(self, failure_threshold=5, recovery_timeout=30.0):
+        """初始化熔断器"""
+        self.failure_threshold = failure_threshold
+        self.recovery_timeout = recovery_timeout
+        self._state = self.CLOSED
+        self._failures = 0
+        self._opened_at = 0.0
+        self._probe_in_flight = False
+        self._lock = threading.Lock()
+
+    @property
+    def state(self):
+        """当前状态，冷却时间已过的打开状态视为半开"""
+        with self._lock:
+            if self._state == self.OPEN and time.monotonic() - self._opened_at >= self.recovery_timeout:
+                return self.HALF_OPEN
+            return self._state
+
+    def is_open(self):
+        """服务商是否处于降级（熔断）状态"""
+        return self.state == self.OPEN
+
+    def allow_request(self):
+        """判断是否允许发送请求"""
+        with self._lock:
+            if self._state == self.CLOSED:
+                return True
+            if self._state == self.OPEN:
+                if time.monotonic() - self._opened_at < self.recovery_timeout:
+                    return False
+                self._state = self.HALF_OPEN
+                self._probe_in_flight = False
+            # 半开状态只放行一个探测请求
+            if self._probe_in_flight:
+                return False
+            self._probe_in_flight = True
+            return True
+
+    def record_success(self):
+        """记录一次成功，恢复到关闭状态"""
+        with self._lock:
+            self._state = self.CLOSED
+            self._failures = 0
+            self._probe_in_flight = False
+
+    def record_failure(self):
+        """记录一次失败，达到阈值或探测失败时打开熔断器"""
+        with self._lock:
+            self._failures += 1
+            self._probe_in_flight = False
+            if self._state == self.HALF_OPEN or self._failures >= self.failure_threshold:
+                self._state = self.OPEN
+                self._opened_at = time.monotonic()
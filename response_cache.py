@@ -0,0 +1,124 @@
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+
+
+class ResponseCache:
+    """模型回复的磁盘缓存
+
+    以模型名、格式化后的消息和采样参数的哈希作为键，使用SQLite保存，
+    支持过期时间（TTL）、按最近访问时间（LRU）淘汰和总大小上限。
+    """
+
+    # 参与计算缓存键的请求字段
+    key_fields = ("model", "messages", "temperature", "top_p", "max_tokens")
+
+    def __init__(self, db_path=None, max_bytes=50 * 1024 * 1024, max_entries=2000, ttl=7 * 24 * 3600):
+        """初始化缓存，默认保存在程序目录下的cache/responses.db"""
+        if db_path is None:
+            db_path = os.path.join(os.path.dirname(__file__), "cache", "responses.db")
+        cache_dir = os.path.dirname(db_path)
+        if cache_dir and not os.path.exists(cache_dir):
+            os.makedirs(cache_dir)
+
+        self.max_bytes = max_bytes
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(db_path, check_same_thread=False)
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS responses ("
+            "key TEXT PRIMARY KEY, model TEXT, value TEXT, "
+            "created REAL, accessed REAL, size INTEGER)"
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS idx_accessed ON responses (accessed)")
+        self._conn.commit()
+
+    def make_key(self, data):
+        """根据请求体计算稳定的缓存键"""
+        key_data = {field: data.get(field) for field in self.key_fields}
+        # 语音数据等不可直接序列化的对象以其标识参与计算
+        serialized = json.dumps(key_data, sort_keys=True, ensure_ascii=False, separators=(",", ":"), default=str)
+        return hashlib.sha256(serialized.encode("utf-8")).hexdigest()
+
+    def get(self, data):
+        """查找缓存的回复，未命中时返回None"""
+        key = self.make_key(data)
+        now = time.time()
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT value, created FROM responses WHERE key = ?", (key,)
+            ).fetchone()
+            if row is not None:
+                value = json.loads(row[0])
+                expired = self.ttl is not None and now - row[1] > self.ttl
+                # 语音回复引用的音频文件已被删除时，缓存也随之失效
+                audio_missing = isinstance(value, dict) and value.get("audio_file") and not os.path.exists(value["audio_file"])
+                if expired or audio_missing:
+                    self._conn.execute("DELETE FROM responses WHERE key = ?", (key,))
+                    self._conn.commit()
+                else:
+                    self._conn.execute("UPDATE responses SET accessed = ? WHERE key = ?", (now, key))
+                    self._conn.commit()
+                    self.hits += 1
+                    return value
+            self.misses += 1
+            return None
+
+    def put(self, data, value):
+        """写入回复并按需淘汰旧条目"""
+        key = self.make_key(data)
+        serialized = json.dumps(value, ensure_ascii=False)
+        now = time.time()
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO responses (key, model, value, created, accessed, size) VALUES (?, ?, ?, ?, ?, ?)",
+                (key, data.get("model"), serialized, now, now, len(serialized.encode("utf-8")))
+            )
+            self._evict(now)
+            self._conn.commit()
+
+    def _evict(self, now):
+        """删除过期条目，再按最近访问时间淘汰直到满足数量和大小上限"""
+        if self.ttl is not None:
+            self._conn.execute("DELETE FROM responses WHERE created < ?", (now - self.ttl,))
+
+        count, total = self._conn.execute("SELECT COUNT(*), COALESCE(SUM(size), 0) FROM responses").fetchone()
+        if count <= self.max_entries and total <= self.max_bytes:
+            return
+
+        evicted = []
+        for key, size in self._conn.execute("SELECT key, size FROM responses ORDER BY accessed ASC"):
+            if count <= self.max_entries and total <= self.max_bytes:
+                break
+            evicted.append((key,))
+            count -= 1
+            total -= size
+        self._conn.executemany("DELETE FROM responses WHERE key = ?", evicted)
+
+    def clear(self):
+        """清空缓存和统计"""
+        with self._lock:
+            self._conn.execute("DELETE FROM responses")
+            self._conn.commit()
+            self.hits = 0
+            self.misses = 0
+
+    def stats(self):
+        """返回命中率、条目数和占用大小等统计信息"""
+        with self._lock:
+            count, total = self._conn.execute("SELECT COUNT(*), COALESCE(SUM(size), 0) FROM responses").fetchone()
+        lookups = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+            "entries": count,
+            "bytes": total
+        }
@@ -0,0 +1,351 @@
+import json
+import queue
+import threading
+from abc import ABC, abstractmethod
+from concurrent.futures import ThreadPoolExecutor
+
+import speech_recognition as sr
+
+
+class RecognitionError(Exception):
+    """语音识别服务不可用或调用失败"""
+    pass
+
+
+class RecognizerBackend(ABC):
+    """语音识别后端的抽象基类
+
+    recognize接收16位单声道PCM数据，返回{"text", "language", "confidence"}字典，
+    未识别出内容时text为None。
+    """
+
+    name = "base"
+    sample_rate = 16000  # 后端期望的录音采样率
+
+    @abstractmethod
+    def recognize(self, pcm_data, sample_rate):
+        """识别一段完整录音的抽象方法"""
+        pass
+
+    def create_stream(self, sample_rate):
+        """创建增量识别会话，不支持流式识别的后端在结束时一次性识别"""
+        return BufferedRecognitionStream(self, sample_rate)
+
+
+class BufferedRecognitionStream:
+    """增量识别会话的默认实现：录音过程中只缓存数据，结束时调用recognize"""
+
+    def __init__(self, backend, sample_rate):
+        """初始化会话"""
+        self.backend = backend
+        self.sample_rate = sample_rate
+        self._chunks = []
+
+    def accept(self, pcm_chunk):
+        """送入一块录音数据，返回当前的部分识别结果（无结果时返回None）"""
+        self._chunks.append(pcm_chunk)
+        return None
+
+    def finish(self):
+        """结束会话并返回最终结果"""
+        return self.backend.recognize(b"".join(self._chunks), self.sample_rate)
+
+
+class BackgroundRecognizer:
+    """在后台线程中运行增量识别会话
+
+    录音回调通过有界队列送入数据，不会被识别速度阻塞；队列溢出时放弃增量结果，
+    由调用方对完整录音重新识别。
+    """
+
+    def __init__(self, backend, sample_rate, on_partial=None, max_pending=64):
+        """初始化，on_partial在部分识别结果变化时被调用（在后台线程中）"""
+        self.backend = backend
+        self.sample_rate = sample_rate
+        self.on_partial = on_partial
+        self.overflow = False
+        self.result = None
+        self._queue = queue.Queue(maxsize=max_pending)
+        self._done = threading.Event()
+        self._closed = False
+        self._cancelled = False
+        self._thread = threading.Thread(target=self._run, daemon=True)
+
+    def start(self):
+        """启动后台识别线程"""
+        self._thread.start()
+        return self
+
+    def feed(self, pcm_chunk):
+        """送入一块录音数据，不阻塞"""
+        if self.overflow:
+            return
+        try:
+            self._queue.put_nowait(pcm_chunk)
+        except queue.Full:
+            self.overflow = True
+            print("增量识别跟不上录音速度，将在录音结束后重新识别")
+
+    def close(self):
+        """录音结束，通知后台线程给出最终结果"""
+        if not self._closed:
+            self._closed = True
+            self._queue.put(None)
+
+    def cancel(self):
+        """放弃本次识别（例如没有检测到说话），不再把数据提交给识别后端"""
+        self._cancelled = True
+        self.close()
+
+    def wait_result(self, timeout=None):
+        """等待最终结果，溢出、取消、出错或超时时返回None"""
+        if not self._done.wait(timeout) or self.overflow or self._cancelled:
+            return None
+        return self.result
+
+    def _run(self):
+        """后台线程：依次识别数据块并报告部分结果"""
+        last_partial = None
+        try:
+            session = self.backend.create_stream(self.sample_rate)
+            while True:
+                chunk = self._queue.get()
+                if chunk is None:
+                    break
+                if self.overflow or self._cancelled:
+                    continue
+                partial = session.accept(chunk)
+                if partial and partial != last_partial and self.on_partial is not None:
+                    last_partial = partial
+                    self.on_partial(partial)
+            if not self.overflow and not self._cancelled:
+                self.result = session.finish()
+        except Exception as e:
+            print(f"增量语音识别出错: {str(e)}")
+            self.result = None
+        finally:
+            self._done.set()
+
+
+class GoogleRecognizerBackend(RecognizerBackend):
+    """Google在线语音识别后端
+
+    Google接口每次请求只能指定一种语言，这里把各候选语言的请求并发发出，
+    按返回的置信度选择结果，只需等待一次网络往返，而不是失败后再依次重试。
+    """
+
+    name = "google"
+
+    def __init__(self, languages=("zh-CN", "en-US"), sample_rate=16000):
+        """初始化，languages按优先级排列"""
+        self.languages = tuple(languages)
+        self.sample_rate = sample_rate
+        self._executor = ThreadPoolExecutor(max_workers=len(self.languages))
+
+    def _recognize_language(self, audio_data, language):
+        """识别单个语言，返回(文本, 置信度)"""
+        recognizer = sr.Recognizer()
+        try:
+            result = recognizer.recognize_google(audio_data, language=language, show_all=True)
+        except sr.UnknownValueError:
+            return None, 0.0
+        if not result or not result.get("alternative"):
+            return None, 0.0
+        best = result["alternative"][0]
+        # 只有最优候选带置信度，缺省时按中等置信度处理
+        return best.get("transcript"), best.get("confidence", 0.5)
+
+    def recognize(self, pcm_data, sample_rate):
+        """并发识别所有候选语言，返回置信度最高的结果"""
+        audio_data = sr.AudioData(pcm_data, sample_rate, 2)
+        futures = [
+            (language, self._executor.submit(self._recognize_language, audio_data, language))
+            for language in self.languages
+        ]
+
+        best = {"text": None, "language": None, "confidence": 0.0}
+        errors = []
+        for language, future in futures:
+            try:
+                text, confidence = future.result()
+            except sr.RequestError as e:
+                errors.append(str(e))
+                continue
+            # 置信度相同时保留优先级更高的语言
+            if text and (best["text"] is None or confidence > best["confidence"]):
+                best = {"text": text, "language": language, "confidence": confidence}
+
+        if best["text"] is None and len(errors) == len(self.languages):
+            raise RecognitionError(errors[0])
+        return best
+
+
+class VoskRecognizerBackend(RecognizerBackend):
+    """基于Vosk的离线语音识别后端
+
+    模型在后台线程中加载一次并常驻内存，多个实例共享同一路径的模型。
+    配置多种语言时，录音只遍历一遍，同时送入各语言的识别器，按词置信度选择结果。
+    """
+
+    name = "vosk"
+
+    _models = {}
+    _models_lock = threading.Lock()
+
+    def __init__(self, model_paths, sample_rate=16000, preload=True):
+        """model_paths为{语言: 模型目录}，例如{"zh-CN": "models/vosk-model-small-cn-0.22"}"""
+        if not model_paths:
+            raise ValueError("未配置Vosk模型路径")
+        try:
+            import vosk
+        except ImportError:
+            raise RuntimeError("离线语音识别需要安装vosk: pip install vosk")
+        vosk.SetLogLevel(-1)
+        self._vosk = vosk
+        self.model_paths = dict(model_paths)
+        self.sample_rate = sample_rate
+        self._ready = threading.Event()
+        self._load_error = None
+        if preload:
+            threading.Thread(target=self._load_models, daemon=True).start()
+        else:
+            self._load_models()
+
+    def _load_models(self):
+        """加载所有语言的模型"""
+        try:
+            for path in self.model_paths.values():
+                with self._models_lock:
+                    if path not in self._models:
+                        print(f"正在加载Vosk模型: {path}")
+                        self._models[path] = self._vosk.Model(path)
+        except Exception as e:
+            self._load_error = e
+            print(f"加载Vosk模型时出错: {str(e)}")
+        finally:
+            self._ready.set()
+
+    def _get_models(self):
+        """等待模型加载完成并返回{语言: 模型}"""
+        self._ready.wait()
+        if self._load_error is not None:
+            raise RecognitionError(f"Vosk模型不可用: {self._load_error}")
+        return {language: self._models[path] for language, path in self.model_paths.items()}
+
+    def create_recognizers(self, sample_rate):
+        """为每种语言创建一个识别器"""
+        recognizers = {}
+        for language, model in self._get_models().items():
+            recognizer = self._vosk.KaldiRecognizer(model, sample_rate)
+            recognizer.SetWords(True)
+            recognizers[language] = recognizer
+        return recognizers
+
+    @staticmethod
+    def parse_result(language, result_json):
+        """解析Vosk的结果JSON，返回(文本, 平均词置信度)"""
+        result = json.loads(result_json)
+        words = result.get("result", [])
+        text = result.get("text", "")
+        if language.startswith("zh"):
+            # 中文模型按词输出并以空格分隔
+            text = "".join(text.split())
+        confidence = sum(word.get("conf", 0.0) for word in words) / len(words) if words else 0.0
+        return text, confidence
+
+    def create_stream(self, sample_rate):
+        """创建真正的流式识别会话，录音过程中即可得到部分结果"""
+        return VoskRecognitionStream(self, sample_rate)
+
+    def recognize(self, pcm_data, sample_rate):
+        """一次遍历录音，返回置信度最高的语言的结果"""
+        stream = self.create_stream(sample_rate)
+        chunk_bytes = 8000
+        view = memoryview(pcm_data)
+        for start in range(0, len(view), chunk_bytes):
+            stream.accept(bytes(view[start:start + chunk_bytes]))
+        return stream.finish()
+
+
+class VoskRecognitionStream:
+    """Vosk的增量识别会话，每块数据同时送入各语言的识别器"""
+
+    def __init__(self, backend, sample_rate):
+        """初始化会话"""
+        self.backend = backend
+        self.recognizers = backend.create_recognizers(sample_rate)
+        self.segments = {language: [] for language in self.recognizers}
+        # 部分结果显示优先级最高（第一个配置）的语言
+        self.primary_language = next(iter(self.recognizers))
+
+    def _joined_text(self, language, extra=""):
+        """拼接某语言已确定的片段和当前部分结果"""
+        texts = [text for text, _ in self.segments[language] if text]
+        if extra:
+            texts.append(extra)
+        separator = "" if language.startswith("zh") else " "
+        return separator.join(texts)
+
+    def accept(self, pcm_chunk):
+        """送入一块录音数据，返回当前的部分识别结果"""
+        for language, recognizer in self.recognizers.items():
+            if recognizer.AcceptWaveform(pcm_chunk):
+                self.segments[language].append(self.backend.parse_result(language, recognizer.Result()))
+
+        partial = json.loads(self.recognizers[self.primary_language].PartialResult()).get("partial", "")
+        if self.primary_language.startswith("zh"):
+            partial = "".join(partial.split())
+        return self._joined_text(self.primary_language, partial) or None
+
+    def finish(self):
+        """结束会话，返回置信度最高的语言的结果"""
+        best = {"text": None, "language": None, "confidence": 0.0}
+        for language, recognizer in self.recognizers.items():
+            self.segments[language].append(self.backend.parse_result(language, recognizer.FinalResult()))
+            confidences = [confidence for text, confidence in self.segments[language] if text]
+            if not confidences:
+                continue
+            confidence = sum(confidences) / len(confidences)
+            if best["text"] is None or confidence > best["confidence"]:
+                best = {"text": self._joined_text(language), "language": language, "confidence": confidence}
+        return best
+
+
+class StaticRecognizerBackend(RecognizerBackend):
+    """本地替身后端，不处理音频，直接返回预设的文本
+
+    用于测试或没有麦克风、网络和模型的环境。responses为字符串列表时按顺序返回，
+    用完后重复最后一项；也可以传入函数，按录音数据生成文本。
+    """
+
+    name = "static"
+
+    def __init__(self, responses=("你好",), language="zh-CN", sample_rate=16000):
+        """初始化替身后端"""
+        self.responses = responses
+        self.language = language
+        self.sample_rate = sample_rate
+        self.calls = []  # 记录每次调用收到的(数据长度, 采样率)
+        self._index = 0
+
+    def recognize(self, pcm_data, sample_rate):
+        """返回预设的文本"""
+        self.calls.append((len(pcm_data), sample_rate))
+        if callable(self.responses):
+            text = self.responses(pcm_data, sample_rate)
+        elif self.responses:
+            text = self.responses[min(self._index, len(self.responses) - 1)]
+            self._index += 1
+        else:
+            text = None
+        return {"text": text, "language": self.language, "confidence": 1.0 if text else 0.0}
+
+
+def create_backend(name, **options):
+    """根据名称创建识别后端，options（配置文件中的speech_backend_options）原样传给后端的构造函数"""
+    if name == "vosk":
+        options.setdefault("model_paths", {})
+        return VoskRecognizerBackend(**options)
+    if name == "static":
+        return StaticRecognizerBackend(**options)
+    return GoogleRecognizerBackend(**options)
@@ -0,0 +1,228 @@
+import tkinter as tk
+from contextlib import contextmanager
+
+
+class TranscriptView:
+    """对话记录的虚拟化显示
+
+    全部消息保存在消息列表中，文本控件只渲染最近的max_rendered条，追加消息时删除最早渲染的消息，
+    插入开销不随会话长度增长。滚动到顶部时再从消息列表载入更早的一页，查看历史期间暂不裁剪，
+    回到底部后再裁剪。
+    较长的文件内容默认折叠显示，点击后展开。
+    """
+
+    file_prefix = "文件内容:\n"
+    stream_mark = "stream_end"  # 流式消息当前的末尾，增量插入在此处
+
+    def __init__(self, text_widget, max_rendered=100, page_size=20, collapse_chars=600, preview_chars=200):
+        """初始化，text_widget为用于显示的Text控件（需已配置sender和message标签）"""
+        self.text = text_widget
+        self.max_rendered = max_rendered
+        self.page_size = page_size
+        self.collapse_file_contents = True
+        self.collapse_chars = collapse_chars
+        self.preview_chars = preview_chars
+
+        self.messages = []  # {"id", "sender", "text", "collapsed"}
+        self.first_rendered = 0  # 渲染窗口中第一条消息在消息列表中的位置
+        self._next_id = 0
+        self._streaming = None
+        self._stream_parts = []  # 流式消息的文本片段，结束时再合并
+        self._batch_depth = 0
+        self._follow_end = True
+
+        # 接管滚动条回调，滚动到顶部时载入更早的消息
+        self._scroll_set = self.text.vbar.set if hasattr(self.text, "vbar") else None
+        self.text.config(yscrollcommand=self._on_scroll)
+        self.text.tag_config("toggle", foreground="#3a7bd5", underline=True)
+
+    def _on_scroll(self, first, last):
+        """滚动条回调：到顶部时载入更早的消息，回到底部时裁剪查看历史期间多渲染的消息"""
+        if self._scroll_set is not None:
+            self._scroll_set(first, last)
+        if self._batch_depth:
+            return
+        if float(first) <= 0.0 and self.first_rendered > 0:
+            self.text.after_idle(self.load_older)
+        elif float(last) >= 0.999 and len(self.messages) - self.first_rendered > self.max_rendered:
+            self.text.after_idle(self._trim_at_end)
+
+    @contextmanager
+    def batch(self):
+        """批量更新：期间只切换一次可编辑状态，结束时最多滚动一次"""
+        if self._batch_depth == 0:
+            # 只有在用户停留在底部时才自动滚动，不打断查看历史
+            self._follow_end = self.text.yview()[1] >= 0.999
+            self.text.config(state=tk.NORMAL)
+        self._batch_depth += 1
+        try:
+            yield
+        finally:
+            self._batch_depth -= 1
+            if self._batch_depth == 0:
+                self.text.config(state=tk.DISABLED)
+                if self._follow_end:
+                    self.text.see(tk.END)
+
+    def _mark(self, message):
+        """消息起始位置的标记名"""
+        return f"msg{message['id']}"
+
+    def _collapsible(self, text):
+        """是否为可以折叠的长文件内容"""
+        return self.collapse_file_contents and text.startswith(self.file_prefix) and len(text) > self.collapse_chars
+
+    def _new_message(self, sender, text):
+        """在消息列表中创建一条消息，长文件内容默认折叠"""
+        message = {"id": self._next_id, "sender": sender, "text": text, "collapsed": self._collapsible(text)}
+        self._next_id += 1
+        self.messages.append(message)
+        return message
+
+    def _render_parts(self, message):
+        """一条消息渲染后的[(文本, 标签)]"""
+        parts = [(f"\n{message['sender']}: ", ("sender",))]
+        text = message["text"]
+        if message["collapsed"]:
+            parts.append((text[:self.preview_chars] + "…", ("message",)))
+            parts.append((f" [展开全文，共{len(text)}字]", ("toggle", f"toggle{message['id']}")))
+        else:
+            parts.append((text, ("message",)))
+            if self._collapsible(text):
+                parts.append((" [收起]", ("toggle", f"toggle{message['id']}")))
+        if message is not self._streaming:
+            parts.append(("\n", ("message",)))
+        return parts
+
+    def _insert_message(self, message, index):
+        """在index处渲染一条消息并设置其起始标记"""
+        start = index = self.text.index(index)
+        for text, tags in self._render_parts(message):
+            self.text.insert(index, text, tags)
+            index = self.text.index(f"{index}+{len(text)}c")
+        mark = self._mark(message)
+        self.text.mark_set(mark, start)
+        # 右侧重力：在标记处插入时标记随之右移，保持指向本消息的开头
+        self.text.mark_gravity(mark, tk.RIGHT)
+        if self._collapsible(message["text"]):
+            tag = f"toggle{message['id']}"
+            self.text.tag_bind(tag, "<Button-1>", lambda event, message_id=message["id"]: self.toggle(message_id))
+
+    def _message_end(self, position):
+        """渲染窗口中第position条消息的结束位置"""
+        if position + 1 < len(self.messages):
+            return self._mark(self.messages[position + 1])
+        return "end-1c"
+
+    def _trim(self):
+        """删除渲染窗口中最早的消息，直到窗口不超过上限"""
+        while len(self.messages) - self.first_rendered > self.max_rendered:
+            message = self.messages[self.first_rendered]
+            self.text.delete("1.0", self._message_end(self.first_rendered))
+            self.text.mark_unset(self._mark(message))
+            if self._collapsible(message["text"]):
+                self.text.tag_delete(f"toggle{message['id']}")
+            self.first_rendered += 1
+
+    def _trim_at_end(self):
+        """用户回到底部后裁剪渲染窗口"""
+        if self.text.yview()[1] < 0.999:
+            return
+        self.text.config(state=tk.NORMAL)
+        self._trim()
+        self.text.config(state=tk.DISABLED)
+        self.text.see(tk.END)
+
+    def append(self, sender, text):
+        """追加一条完整的消息，用户正在查看历史时暂不裁剪；text不是字符串时（例如APIError）按str()显示"""
+        with self.batch():
+            message = self._new_message(str(sender), str(text))
+            self._insert_message(message, "end-1c")
+            if self._follow_end:
+                self._trim()
+        return message["id"]
+
+    def start_stream(self, sender):
+        """开始一条流式消息"""
+        with self.batch():
+            message = self._new_message(sender, "")
+            self._streaming = message
+            self._stream_parts = []
+            self._insert_message(message, "end-1c")
+            # 左侧重力：流式消息之后追加的完整消息不会移动该标记
+            self.text.mark_set(self.stream_mark, "end-1c")
+            self.text.mark_gravity(self.stream_mark, tk.LEFT)
+            if self._follow_end:
+                self._trim()
+
+    def _insert_at_stream_end(self, text):
+        """在流式消息末尾插入文本，流式期间插入的其他消息保持在其后"""
+        index = self.text.index(self.stream_mark)
+        self.text.insert(index, text, ("message",))
+        self.text.mark_set(self.stream_mark, f"{index}+{len(text)}c")
+
+    def append_stream(self, text):
+        """向流式消息追加文本"""
+        if self._streaming is None:
+            return
+        with self.batch():
+            self._stream_parts.append(text)
+            self._insert_at_stream_end(text)
+
+    def end_stream(self):
+        """结束流式消息"""
+        if self._streaming is None:
+            return
+        with self.batch():
+            self._streaming["text"] = "".join(self._stream_parts)
+            self._streaming = None
+            self._stream_parts = []
+            self._insert_at_stream_end("\n")
+            self.text.mark_unset(self.stream_mark)
+
+    def load_older(self):
+        """在顶部载入更早的一页消息，保持当前查看的位置"""
+        if self.first_rendered == 0:
+            return
+        anchor = self._mark(self.messages[self.first_rendered])
+        start = max(0, self.first_rendered - self.page_size)
+        self.text.config(state=tk.NORMAL)
+        for message in reversed(self.messages[start:self.first_rendered]):
+            self._insert_message(message, "1.0")
+        self.text.config(state=tk.DISABLED)
+        self.first_rendered = start
+        self.text.yview(anchor)
+
+    def toggle(self, message_id):
+        """展开或折叠一条消息"""
+        for position in range(self.first_rendered, len(self.messages)):
+            message = self.messages[position]
+            if message["id"] == message_id:
+                break
+        else:
+            return
+        mark = self._mark(message)
+        start = self.text.index(mark)
+        view = self.text.yview()[0]
+        self.text.config(state=tk.NORMAL)
+        self.text.delete(start, self._message_end(position))
+        message["collapsed"] = not message["collapsed"]
+        self._insert_message(message, start)
+        self.text.config(state=tk.DISABLED)
+        self.text.yview_moveto(view)
+
+    def clear(self):
+        """清空消息列表和显示"""
+        self.messages = []
+        self.first_rendered = 0
+        self._streaming = None
+        self._stream_parts = []
+        self.text.config(state=tk.NORMAL)
+        for mark in self.text.mark_names():
+            if mark.startswith("msg") or mark == self.stream_mark:
+                self.text.mark_unset(mark)
+        for tag in self.text.tag_names():
+            if tag.startswith("toggle") and tag != "toggle":
+                self.text.tag_delete(tag)
+        self.text.delete("1.0", tk.END)
+        self.text.config(state=tk.DISABLED)
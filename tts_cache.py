@@ -0,0 +1,156 @@
+import hashlib
+import os
+import threading
+import time
+import uuid
+from collections import OrderedDict
+
+
+class TTSCache:
+    """本地语音合成结果的磁盘缓存
+
+    以文本、音色、语速和音量的哈希作为文件名保存WAV文件，重复的句子直接播放缓存。
+    新文件先写入唯一的临时文件名再用os.replace原子地替换到位，并发合成不会互相覆盖；
+    按最近使用时间（LRU）淘汰，总大小不超过上限。
+    """
+
+    def __init__(self, cache_dir=None, max_bytes=64 * 1024 * 1024):
+        """初始化缓存，默认保存在程序目录下的temp/tts_cache"""
+        if cache_dir is None:
+            cache_dir = os.path.join(os.path.dirname(__file__), "temp", "tts_cache")
+        os.makedirs(cache_dir, exist_ok=True)
+
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()  # 键 -> 文件大小，按最近使用排序
+        self._total_bytes = 0
+        self._pinned = {}  # 正在播放或等待播放的键 -> 引用计数，不会被淘汰
+        self._load_index()
+
+    def _load_index(self):
+        """扫描缓存目录，按修改时间恢复LRU顺序，清理上次遗留的临时文件"""
+        files = []
+        for name in os.listdir(self.cache_dir):
+            path = os.path.join(self.cache_dir, name)
+            if name.endswith(".tmp.wav"):
+                try:
+                    os.unlink(path)
+                except OSError:
+                    pass
+                continue
+            if not name.endswith(".wav"):
+                continue
+            stat = os.stat(path)
+            files.append((stat.st_mtime, name[:-4], stat.st_size))
+        for _, key, size in sorted(files):
+            self._entries[key] = size
+            self._total_bytes += size
+
+    @staticmethod
+    def make_key(text, voice=None, rate=None, volume=None):
+        """根据文本和合成参数计算缓存键"""
+        serialized = "\x00".join(str(part) for part in (text, voice, rate, volume))
+        return hashlib.sha256(serialized.encode("utf-8")).hexdigest()
+
+    def path_for(self, key):
+        """缓存键对应的文件路径"""
+        return os.path.join(self.cache_dir, f"{key}.wav")
+
+    def temp_path(self):
+        """为一次合成生成唯一的临时文件路径"""
+        # 保留.wav扩展名，部分TTS驱动按扩展名决定输出格式
+        return os.path.join(self.cache_dir, f"{uuid.uuid4().hex}.tmp.wav")
+
+    def get(self, key):
+        """查找缓存的音频文件，命中时返回路径，否则返回None"""
+        path = self.path_for(key)
+        with self._lock:
+            if key in self._entries and os.path.exists(path):
+                self._entries.move_to_end(key)
+                self.hits += 1
+                hit = True
+            else:
+                if key in self._entries:
+                    self._total_bytes -= self._entries.pop(key)
+                self.misses += 1
+                hit = False
+        if hit:
+            # 用修改时间记录最近使用，重启后仍能恢复LRU顺序
+            try:
+                os.utime(path, (time.time(), time.time()))
+            except OSError:
+                pass
+            return path
+        return None
+
+    def put(self, key, temp_file):
+        """把合成好的临时文件原子地移入缓存，返回缓存文件路径"""
+        path = self.path_for(key)
+        size = os.path.getsize(temp_file)
+        os.replace(temp_file, path)
+        with self._lock:
+            if key in self._entries:
+                self._total_bytes -= self._entries[key]
+            self._entries[key] = size
+            self._entries.move_to_end(key)
+            self._total_bytes += size
+            self._evict()
+        return path
+
+    def pin(self, key):
+        """标记文件正在使用，淘汰时跳过"""
+        with self._lock:
+            self._pinned[key] = self._pinned.get(key, 0) + 1
+
+    def unpin(self, key):
+        """取消使用标记"""
+        with self._lock:
+            count = self._pinned.get(key, 0) - 1
+            if count > 0:
+                self._pinned[key] = count
+            else:
+                self._pinned.pop(key, None)
+
+    def _evict(self):
+        """按最近使用时间淘汰文件直到满足大小上限"""
+        for key in list(self._entries):
+            if self._total_bytes <= self.max_bytes:
+                break
+            if key in self._pinned or len(self._entries) <= 1:
+                continue
+            self._total_bytes -= self._entries.pop(key)
+            try:
+                os.unlink(self.path_for(key))
+            except OSError as e:
+                print(f"删除语音缓存文件时出错: {str(e)}")
+
+    def clear(self):
+        """清空缓存和统计"""
+        with self._lock:
+            for key in list(self._entries):
+                if key in self._pinned:
+                    continue
+                self._total_bytes -= self._entries.pop(key)
+                try:
+                    os.unlink(self.path_for(key))
+                except OSError:
+                    pass
+            self.hits = 0
+            self.misses = 0
+
+    def stats(self):
+        """返回命中率、文件数和占用大小等统计信息"""
+        with self._lock:
+            count, total = len(self._entries), self._total_bytes
+        lookups = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+            "entries": count,
+            "bytes": total
+        }
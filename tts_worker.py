@@ -0,0 +1,272 @@
+import os
+import queue
+import re
+import threading
+import uuid
+
+import pyttsx3
+
+
+# 句末标点：中文句号、问号、感叹号、分号，以及后面跟空白的英文句末标点
+_SENTENCE_END = re.compile(r"[。！？；!?;]+[”’\"')）]*|\.+[”’\"')）]*(?=\s)|\n+")
+# 句子过长时可以提前断开的位置
+_SOFT_BREAK = re.compile(r"[，、：,:]")
+
+
+class SentenceSplitter:
+    """增量句子切分器
+
+    逐段送入流式回复的文本，每凑出一个完整句子就立即返回，
+    供语音合成尽早开始。缓冲区只保留尚未结束的半句，每次只扫描这部分文本。
+    """
+
+    def __init__(self, max_chars=80):
+        """max_chars为单句的最大长度，超过时在逗号等位置提前断开"""
+        self.max_chars = max_chars
+        self._buffer = ""
+
+    def feed(self, text):
+        """送入一段文本，返回其中已经完整的句子列表"""
+        self._buffer += text
+        sentences = []
+        position = 0
+        for match in _SENTENCE_END.finditer(self._buffer):
+            sentence = self._buffer[position:match.end()].strip()
+            if sentence:
+                sentences.append(sentence)
+            position = match.end()
+        self._buffer = self._buffer[position:]
+
+        # 没有句末标点的长句在最后一个逗号处断开，避免长时间等待
+        if len(self._buffer) > self.max_chars:
+            soft_breaks = list(_SOFT_BREAK.finditer(self._buffer))
+            if soft_breaks:
+                end = soft_breaks[-1].end()
+                sentence = self._buffer[:end].strip()
+                if sentence:
+                    sentences.append(sentence)
+                self._buffer = self._buffer[end:]
+        return sentences
+
+    def flush(self):
+        """文本结束，返回剩余的半句（没有时返回空列表）"""
+        rest = self._buffer.strip()
+        self._buffer = ""
+        return [rest] if rest else []
+
+
+def split_sentences(text):
+    """把整段文本切分为适合逐句合成的句子，去掉空白句子"""
+    splitter = SentenceSplitter()
+    return splitter.feed(text) + splitter.flush()
+
+
+class TTSWorker:
+    """常驻的本地语音合成工作线程
+
+    合成线程在启动时创建pyttsx3引擎并一直持有，逐句把文本合成为WAV文件；
+    播放线程依次播放合成好的句子。播放第N句时合成线程已在合成第N+1句，
+    回复的第一句合成完即可开始朗读。cancel会丢弃所有未播放的句子并停止当前播放。
+    配置了cache时合成结果保存在缓存中，重复的句子不再合成。
+    """
+
+    def __init__(self, play_func, stop_func=None, temp_dir=None, rate=180, volume=1.0, lookahead=2, cache=None,
+                 preload_func=None):
+        """play_func(文件路径)阻塞播放一个音频文件，stop_func停止当前播放，preload_func预先解码合成好的文件"""
+        if temp_dir is None:
+            temp_dir = os.path.join(os.path.dirname(__file__), "temp")
+        self.play_func = play_func
+        self.stop_func = stop_func
+        self.temp_dir = temp_dir
+        self.cache = cache
+        self.preload_func = preload_func
+        self.rate = rate
+        self.volume = volume
+
+        self._generation = 0  # 每次取消加一，旧的句子和音频随之作废
+        self._lock = threading.Lock()
+        self._text_queue = queue.Queue()
+        # 合成结果最多领先播放lookahead句，避免长回复一次性合成大量文件
+        self._audio_queue = queue.Queue(maxsize=lookahead)
+        self._idle = threading.Event()
+        self._idle.set()
+        self._pending = 0  # 已提交但尚未播放完的句子数
+        self._engine = None
+
+        self._synth_thread = threading.Thread(target=self._synthesize_loop, daemon=True)
+        self._play_thread = threading.Thread(target=self._play_loop, daemon=True)
+        self._synth_thread.start()
+        self._play_thread.start()
+
+    def speak(self, text):
+        """把一段文本切分成句子后加入朗读队列"""
+        for sentence in split_sentences(text):
+            self.enqueue(sentence)
+
+    def enqueue(self, sentence):
+        """把一个句子加入朗读队列"""
+        with self._lock:
+            generation = self._generation
+            self._pending += 1
+            self._idle.clear()
+        self._text_queue.put((generation, sentence))
+
+    def skip(self):
+        """停止当前句子，继续朗读后面的句子"""
+        if self.stop_func is not None:
+            self.stop_func()
+
+    def cancel(self):
+        """丢弃所有未朗读的句子并停止当前播放"""
+        with self._lock:
+            self._generation += 1
+            self._pending = 0
+            self._idle.set()
+        for pending in (self._text_queue, self._audio_queue):
+            while True:
+                try:
+                    item = pending.get_nowait()
+                except queue.Empty:
+                    break
+                if item is not None and pending is self._audio_queue:
+                    self._release(item[1], item[2])
+        if self.stop_func is not None:
+            self.stop_func()
+
+    def wait_idle(self, timeout=None):
+        """等待队列中的句子全部朗读完毕"""
+        return self._idle.wait(timeout)
+
+    def stop(self):
+        """停止工作线程"""
+        self.cancel()
+        self._text_queue.put(None)
+
+    def _is_current(self, generation):
+        """句子是否属于当前这一轮朗读"""
+        with self._lock:
+            return generation == self._generation
+
+    def _finish_item(self, generation):
+        """一个句子朗读完毕或被丢弃，已取消的轮次不再计数"""
+        with self._lock:
+            if generation != self._generation:
+                return
+            self._pending -= 1
+            if self._pending == 0:
+                self._idle.set()
+
+    def _create_engine(self):
+        """创建并配置TTS引擎"""
+        engine = pyttsx3.init()
+        engine.setProperty('rate', self.rate)  # 语速
+        engine.setProperty('volume', self.volume)  # 音量
+        return engine
+
+    def _synthesize(self, sentence):
+        """合成一个句子，返回(文件路径, 缓存键)，未使用缓存时缓存键为None"""
+        if self.cache is None:
+            if not os.path.exists(self.temp_dir):
+                os.makedirs(self.temp_dir, exist_ok=True)
+            return self._synthesize_to(sentence, os.path.join(self.temp_dir, f"tts_{uuid.uuid4().hex}.wav")), None
+
+        voice = self._engine.getProperty('voice')
+        key = self.cache.make_key(sentence, voice, self.rate, self.volume)
+        # 在查找或写入前先标记使用，避免等待播放期间被淘汰
+        self.cache.pin(key)
+        cached_file = self.cache.get(key)
+        if cached_file is not None:
+            return cached_file, key
+        try:
+            temp_file = self._synthesize_to(sentence, self.cache.temp_path())
+            if temp_file is not None:
+                return self.cache.put(key, temp_file), key
+        except Exception:
+            self.cache.unpin(key)
+            raise
+        self.cache.unpin(key)
+        return None, None
+
+    def _synthesize_to(self, sentence, temp_file):
+        """把一个句子合成到指定的WAV文件，失败时返回None"""
+        try:
+            self._engine.save_to_file(sentence, temp_file)
+            self._engine.runAndWait()
+        except RuntimeError:
+            # 引擎事件循环状态异常时重新创建引擎
+            print("TTS引擎状态异常，重新初始化...")
+            self._engine = self._create_engine()
+            self._engine.save_to_file(sentence, temp_file)
+            self._engine.runAndWait()
+        # runAndWait返回时文件已写完，不需要额外等待
+        if not os.path.exists(temp_file) or os.path.getsize(temp_file) == 0:
+            self._remove_file(temp_file)
+            return None
+        return temp_file
+
+    def _synthesize_loop(self):
+        """合成线程：持有引擎，依次合成句子"""
+        try:
+            self._engine = self._create_engine()
+        except Exception as e:
+            print(f"初始化TTS引擎时出错: {str(e)}")
+
+        while True:
+            item = self._text_queue.get()
+            if item is None:
+                self._audio_queue.put(None)
+                return
+            generation, sentence = item
+            if not self._is_current(generation) or self._engine is None:
+                self._finish_item(generation)
+                continue
+            try:
+                audio_file, key = self._synthesize(sentence)
+            except Exception as e:
+                print(f"语音合成错误: {str(e)}")
+                audio_file, key = None, None
+            if audio_file is None or not self._is_current(generation):
+                self._release(audio_file, key)
+                self._finish_item(generation)
+                continue
+            if self.preload_func is not None:
+                # 在合成线程中解码，轮到这一句时可以立即播放
+                try:
+                    self.preload_func(audio_file)
+                except Exception as e:
+                    print(f"预加载合成语音时出错: {str(e)}")
+            self._audio_queue.put((generation, audio_file, key))
+
+    def _play_loop(self):
+        """播放线程：依次播放合成好的句子并删除临时文件"""
+        while True:
+            item = self._audio_queue.get()
+            if item is None:
+                return
+            generation, audio_file, key = item
+            try:
+                if self._is_current(generation):
+                    self.play_func(audio_file)
+            except Exception as e:
+                print(f"播放合成语音时出错: {str(e)}")
+            finally:
+                self._release(audio_file, key)
+                self._finish_item(generation)
+
+    def _release(self, audio_file, key):
+        """句子播放完毕或被丢弃：缓存文件取消使用标记，临时文件直接删除"""
+        if key is not None:
+            self.cache.unpin(key)
+        else:
+            self._remove_file(audio_file)
+
+    @staticmethod
+    def _remove_file(file_path):
+        """删除临时文件"""
+        if not file_path:
+            return
+        try:
+            if os.path.exists(file_path):
+                os.unlink(file_path)
+        except Exception as e:
+            print(f"删除临时文件时出错: {str(e)}")